@@ -2,7 +2,7 @@
 
 {
     'name': 'Dynamic sequence',
-    'version': '1.0.4.11',
+    'version': '1.0.5.0',
     'author':'Soft-integration',
     'category': 'Base',
     'summary': 'Dynamic sequence',
@@ -10,6 +10,8 @@
     'depends': [
     ],
     'data': [
+        'security/ir.model.access.csv',
+        'data/ir_cron_data.xml',
         'views/ir_sequence_views.xml',
         'views/sequence_dynamic_action.xml',
         'views/sequence_dynamic_menuitem.xml'
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the hot path of the dynamic sequences.
+
+They must be run against a disposable database where the module sequence_dynamic is installed,the fixtures (sequence
+templates and their child sequences) are committed because the parallel benchmark uses several cursors,they are removed
+at the end unless --keep is given.
+
+    python benchmarks/bench_sequence_dynamic.py -c /etc/odoo/odoo.conf -d bench_db --output bench_output.json
+
+The results are written as JSON,one entry by benchmark with its throughput (operations by second) and its p50/p99
+latencies in milliseconds.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime
+
+import odoo
+from odoo import SUPERUSER_ID, api
+from psycopg2 import errorcodes, OperationalError
+
+RELATED_MODEL = 'res.partner'
+BENCH_CODE = 'sequence_dynamic.bench'
+# the generator codes of the children must be unique by company,so they are all prefixed by this tag
+BENCH_TAG = 'BENCH'
+
+# name of the benchmark: sequence generator code of the template
+BUILD_CODE_CASES = {
+    'char': '%(ref)',
+    'integer_padding': '%(color[5])',
+    'many2one_nested': '%(country_id.code)',
+}
+
+
+def percentile(latencies, rank):
+    latencies = sorted(latencies)
+    index = max(int(math.ceil(rank / 100.0 * len(latencies))) - 1, 0)
+    return latencies[index]
+
+
+def summarize(name, latencies, **extra):
+    """ Return the result of a benchmark from the latencies (in seconds) of its operations"""
+    total = sum(latencies)
+    result = {
+        'name': name,
+        'iterations': len(latencies),
+        'throughput_per_s': round(len(latencies) / total, 2) if total else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 4),
+    }
+    result.update(extra)
+    return result
+
+
+def timed(function, iterations):
+    latencies = []
+    for index in range(iterations):
+        start = time.perf_counter()
+        function(index)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def create_template(env, code, generator_code, implementation='standard', dynamic_prefix_code=False):
+    return env['ir.sequence'].create({
+        'name': 'Benchmark %s' % code,
+        'code': code,
+        'sequence_type': 'sequence_template',
+        'related_model': env['ir.model']._get(RELATED_MODEL).id,
+        'implementation': implementation,
+        'dynamic_prefix_code': dynamic_prefix_code,
+        'sequence_generator_code': generator_code,
+        'padding': 5,
+    })
+
+
+def create_children(template, count, chunk_size=1000):
+    """ Create count children to the template,their generator code is the value of the field ref used in the
+    dynamic fields of the benchmark"""
+    cr = template.env.cr
+    for start in range(0, count, chunk_size):
+        keys = [(False, '%s-%s-%07d' % (BENCH_TAG, template.id, index))
+                for index in range(start, min(start + chunk_size, count))]
+        template._create_sequences_from_template(keys)
+        cr.commit()
+
+
+def bench_parsing(env, iterations):
+    sequence = env['ir.sequence']
+    code = '%(**INV/,ref,color[5],country_id.code,**/)'
+    return [
+        summarize('parse_fields', timed(lambda index: sequence._parse_fields(code, remove_static_fields=True),
+                                        iterations)),
+        summarize('get_field_padding', timed(lambda index: sequence._get_field_padding('color[5]'), iterations)),
+    ]
+
+
+def bench_build_code(env, iterations):
+    from odoo.addons.sequence_dynamic.models.ir_sequence import TYPE_CODE_GENERATOR
+    country = env['res.country'].search([], limit=1)
+    dynamic_prefix_fields = {'ref': 'REF', 'color': 42, 'country_id': country.id}
+    results = []
+    for name, generator_code in BUILD_CODE_CASES.items():
+        template = create_template(env, '%s.build.%s' % (BENCH_CODE, name), generator_code)
+        env.cr.commit()
+        latencies = timed(lambda index: template._build_code(TYPE_CODE_GENERATOR,
+                                                             dynamic_prefix_fields=dynamic_prefix_fields), iterations)
+        results.append(summarize('build_code_%s' % name, latencies))
+    return results
+
+
+def bench_next_by_code(env, children_counts, iterations):
+    results = []
+    for children_count in children_counts:
+        code = '%s.next.%s' % (BENCH_CODE, children_count)
+        template = create_template(env, code, '%(ref)')
+        env.cr.commit()
+        create_children(template, children_count)
+        sequence = env['ir.sequence'].with_context(related_model=RELATED_MODEL)
+
+        def next_by_code(index):
+            ref = '%s-%s-%07d' % (BENCH_TAG, template.id, random.randrange(children_count))
+            sequence.with_context(dynamic_prefix_fields={'ref': ref}).next_by_code(code)
+
+        latencies = timed(next_by_code, iterations)
+        env.cr.commit()
+        results.append(summarize('next_by_code_%s_children' % children_count, latencies,
+                                 children=children_count))
+    return results
+
+
+def bench_parallel(registry, env, workers, iterations, children_count):
+    code = '%s.parallel' % BENCH_CODE
+    template = create_template(env, code, '%(ref)')
+    env.cr.commit()
+    create_children(template, children_count)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker():
+        worker_latencies, worker_errors = [], 0
+        with registry.cursor() as cr:
+            sequence = api.Environment(cr, SUPERUSER_ID, {'related_model': RELATED_MODEL})['ir.sequence']
+            for index in range(iterations):
+                ref = '%s-%s-%07d' % (BENCH_TAG, template.id, random.randrange(children_count))
+                start = time.perf_counter()
+                try:
+                    sequence.with_context(dynamic_prefix_fields={'ref': ref}).next_by_code(code)
+                    cr.commit()
+                except OperationalError as e:
+                    cr.rollback()
+                    if e.pgcode not in (errorcodes.SERIALIZATION_FAILURE, errorcodes.LOCK_NOT_AVAILABLE,
+                                        errorcodes.DEADLOCK_DETECTED):
+                        raise
+                    worker_errors += 1
+                worker_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(worker_latencies)
+            errors.append(worker_errors)
+
+    threads = [threading.Thread(target=worker) for index in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    result = summarize('next_by_code_parallel', latencies, workers=workers, children=children_count,
+                       concurrency_errors=sum(errors))
+    # the operations overlap,the throughput is the one observed on the wall clock
+    result['throughput_per_s'] = round(len(latencies) / elapsed, 2)
+    return [result]
+
+
+def bench_child_creation(env, iterations):
+    template = create_template(env, '%s.creation' % BENCH_CODE, '%(ref)')
+    env.cr.commit()
+
+    def create_child(index):
+        template._create_sequence_from_template(generator_code='%s-%s-new-%07d' % (BENCH_TAG, template.id, index))
+
+    latencies = timed(create_child, iterations)
+    env.cr.commit()
+    return [summarize('create_sequence_from_template', latencies)]
+
+
+def cleanup(env):
+    templates = env['ir.sequence'].search([('code', '=like', BENCH_CODE + '%'),
+                                           ('sequence_type', '=', 'sequence_template')])
+    env['ir.sequence'].with_context(active_test=False).search([('parent_id', 'in', templates.ids)]).unlink()
+    templates.unlink()
+    env.cr.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', help='Odoo configuration file')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--children', default='1,1000,100000',
+                        help='comma-separated numbers of existing children for the next_by_code benchmarks')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--keep', action='store_true', help='keep the fixtures in the database')
+    args = parser.parse_args()
+
+    odoo.tools.config.parse_config(['-c', args.config] if args.config else [])
+    registry = odoo.registry(args.database)
+    children_counts = [int(count) for count in args.children.split(',')]
+    results = []
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        cleanup(env)
+        try:
+            results += bench_parsing(env, args.iterations)
+            results += bench_build_code(env, args.iterations)
+            results += bench_next_by_code(env, children_counts, args.iterations)
+            results += bench_parallel(registry, env, args.workers, args.iterations, min(max(children_counts), 1000))
+            results += bench_child_creation(env, min(args.iterations, 100))
+        finally:
+            cr.rollback()
+            if not args.keep:
+                cleanup(env)
+    output = {
+        'database': args.database,
+        'odoo_version': odoo.release.version,
+        'date': datetime.utcnow().isoformat(),
+        'results': results,
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(output, output_file, indent=2)
+    print(json.dumps(output, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,4 @@
 # -*- coding: utf-8 -*-
-from . import ir_sequence
\ No newline at end of file
+from . import ir_sequence
+from . import ir_sequence_counter
+from . import ir_sequence_date_range
\ No newline at end of file
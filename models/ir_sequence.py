@@ -1,9 +1,34 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import fields, models, api, _
-from odoo.exceptions import ValidationError, UserError
+from odoo import fields, models, api, tools, _
+from odoo.exceptions import ValidationError, UserError, MissingError
+from odoo.addons.base.models.ir_sequence import _create_sequence, _drop_sequences
+from odoo.osv import expression
+from psycopg2 import errorcodes, IntegrityError, OperationalError
+from collections import defaultdict, deque, namedtuple
+from . import sequence_metrics
+from .sequence_metrics import instrumented
+import contextlib
 import datetime
+import json
+import logging
+import re
+import threading
+import uuid
+
+_logger = logging.getLogger(__name__)
+
+# Blocks of numbers reserved by this worker (see number_block_size)
+# (dbname, id of the sequence): {start of the date range or False: (write_date of the sequence, end of the date range
+# or False, numbers not given yet)}
+_number_blocks = {}
+_number_blocks_lock = threading.Lock()
+# (dbname, id of the child sequence): last date its use has been stored in last_used_date by this worker
+_child_last_use = {}
+# (dbname, id of the template): {(company_id, prefix, generator_code): id of the child sequence} found by the committed
+# transactions of this worker,the ids are checked when the child sequences are read (see _get_or_create_child_sequences)
+_child_sequence_ids = {}
 
 DYNAMIC_PREFIX_DELIMITER = '%'
 DYNAMIC_PREFIX_START_VAR = '('
@@ -16,6 +41,43 @@ TYPE_DYNAMIC_SUFF_CODE = 'dynamic_suffix_code'
 TYPE_DYNAMIC_PREF_CODE = 'dynamic_prefix_code'
 TYPE_CODE_GENERATOR = 'sequence_generator_code'
 
+# provisional references of the deferred numbering (see deferred_numbering)
+DEFERRED_REFERENCE_PREFIX = 'TMP/'
+DEFERRED_REFERENCES_KEY = 'sequence_dynamic.deferred_references'
+# number of provisional references searched in one query by _assign_deferred_references
+DEFERRED_SEARCH_CHUNK_SIZE = 500
+CHILD_LAST_USE_KEY = 'sequence_dynamic.child_last_use'
+CHILD_IDS_KEY = 'sequence_dynamic.child_ids'
+# number of days without use after which a child sequence is archived by _cron_archive_idle_child_sequences
+CHILD_IDLE_DAYS_PARAM = 'sequence_dynamic.child_idle_days'
+
+# number of digits of the date values interpolated in the prefix/suffix of a sequence (see _get_prefix_suffix)
+INTERPOLATED_DATE_DIGITS = {'year': 4, 'month': 2, 'day': 2, 'y': 2, 'doy': 3, 'woy': 2, 'weekday': 1, 'h24': 2, 'h12': 2,
+                            'min': 2, 'sec': 2}
+# greatest next number of a sequence,its column number_next is an integer
+MAX_NUMBER_NEXT = 2147483647
+
+# Fields whose modification must invalidate the caches of this module
+CACHE_INVALIDATION_FIELDS = {'code', 'sequence_type', 'sequence', 'related_model', TYPE_DYNAMIC_PREF_CODE,
+                             TYPE_DYNAMIC_SUFF_CODE, TYPE_CODE_GENERATOR, 'parent_id', 'prefix', 'generator_code', 'company_id', 'active'}
+
+# One element of a compiled dynamic code: either a static value or a field of the related model
+# (field_name is the first field of the chain,path is the whole dotted chain used for the many2one fields)
+CodeToken = namedtuple('CodeToken', ['static_value', 'field_name', 'path', 'padding', 'field_type'])
+
+
+class DynamicCodeContext(object):
+    """ Values of the dynamic fields used to generate one reference,shared by the suffix,the prefix and the sequence
+    generator code so each field and each many2one chain is resolved only once"""
+
+    def __init__(self, related_model, dynamic_prefix_fields):
+        self.related_model = related_model
+        self.dynamic_prefix_fields = dynamic_prefix_fields
+        # path of the field (without padding): value
+        self.values = {}
+        # many2one field: record of its value
+        self.records = {}
+
 
 class IrSequence(models.Model):
     _inherit = 'ir.sequence'
@@ -29,6 +91,18 @@ class IrSequence(models.Model):
                                          "the fields put in the dynamic part with the controls existing on this Model)")
     dynamic_prefix_code = fields.Text(string='Dynamic prefix codification',
                                       help='Please take in account all this constraints specified under <Legend for dynamic prefix>')
+    storage_mode = fields.Selection([('sequence', 'Child sequences'), ('counter', 'Counters')],
+                                    string='Storage mode', required=True, default='sequence',
+                                    help="Child sequences: a sequence is created for each new prefix/generator code\n"
+                                         "Counters: the numbers of each prefix/generator code are kept in a compact table of "
+                                         "counters incremented atomically,the references are the same but no sequence is "
+                                         "created (the numbers are given without gaps as with the No gap implementation)")
+    deferred_numbering = fields.Boolean(string='Deferred numbering',
+                                        help="The records get a provisional reference when they are created and the final "
+                                             "one is taken from the child sequence at the commit of the transaction,so the "
+                                             "lock of a No gap child sequence is only held during the commit.\n"
+                                             "The reference must be stored in the field given by the context key "
+                                             "deferred_field (name by default) of the related model")
     generate_new_sequence = fields.Boolean(string='Generate sequence by format', default=True,
                                            help="Select this if you want to generate new sequence for each new format detected")
     sequence_generator_code = fields.Text(string='Sequence generator code',
@@ -42,28 +116,94 @@ class IrSequence(models.Model):
                                  help='This code is unique by sequence,and is used to generate new sequence or return sequence it match')
     parent_id = fields.Many2one('ir.sequence', string='Parent sequence',
                                 help='The sequence model that create this sequence')
+    last_used_date = fields.Date(string='Last used on', readonly=True, copy=False,
+                                 help='Last day a number of this child sequence has been requested')
+    idle_archived = fields.Boolean(string='Archived as idle', readonly=True, copy=False,
+                                   help="The child sequence has been archived because it wasn't used,its PostgreSQL "
+                                        "sequences are dropped and its next numbers are kept in the sequence,it is "
+                                        "restored automatically the next time its generator code is used")
     child_ids = fields.Many2many('ir.sequence', compute='_compute_child_ids')
     child_count = fields.Integer(compute='_compute_child_count')
+    number_block_size = fields.Integer(string='Numbers reserved by worker', default=0,
+                                       help="If greater than 1,each worker reserves blocks of this number of numbers "
+                                            "and gives them from memory,this reduces the queries on the sequences used "
+                                            "at high rate but the numbers not given before a restart are lost (gaps),"
+                                            "only allowed with the Standard implementation")
+    dynamic_metrics = fields.Text(string='Metrics', compute='_compute_dynamic_metrics',
+                                  help="Metrics of the dynamic sequence collected by the current worker since its start,"
+                                       "available only if the option sequence_dynamic_metrics is set in the server configuration")
 
     _sql_constraints = [
         ('generator_code_uniq', 'unique (generator_code,company_id)', "Generator_code name already exists !")]
 
+    def init(self):
+        # the lookup of the child sequence of a template is done on these columns (see _get_child_sequence_id)
+        tools.create_index(self._cr, 'ir_sequence_parent_generator_prefix_index', self._table,
+                           ['parent_id', 'generator_code', 'prefix', 'company_id'])
+        # a child sequence can be created only once by key,the concurrent creations rely on it (see _create_child_sequences)
+        try:
+            with self._cr.savepoint(flush=False):
+                self._cr.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS ir_sequence_child_key_uniq ON ir_sequence
+                    (parent_id, COALESCE(company_id, 0), COALESCE(prefix, ''), COALESCE(generator_code, ''))
+                    WHERE parent_id IS NOT NULL
+                """)
+        except IntegrityError:
+            _logger.warning("Duplicated child sequences (same template,company,prefix and generator code) found,the "
+                            "index ir_sequence_child_key_uniq can not be created until they are merged")
+        # the idle period of the child sequences created before the tracking of their last use starts now
+        self._cr.execute("UPDATE ir_sequence SET last_used_date = CURRENT_DATE "
+                         "WHERE parent_id IS NOT NULL AND last_used_date IS NULL")
+
     # FIXME: this method must be removed from here
     @api.model
     def _translate_dynamic_values(self, src):
         domain = [('src', '=', src), ('lang', '=', self.env.context.get('lang'))]
         return self.env['ir.translation'].search(domain, limit=1).value or src
 
-    @api.depends('child_ids')
     def _compute_child_count(self):
-        self.child_count = len(self.child_ids)
+        data = self.read_group([('parent_id', 'in', self.ids)], ['parent_id'], ['parent_id'])
+        child_counts = {item['parent_id'][0]: item['parent_id_count'] for item in data}
+        for sequence in self:
+            sequence.child_count = child_counts.get(sequence.id, 0)
 
     def _compute_child_ids(self):
-        domain = [('parent_id', '=', self.id)]
-        self.child_ids = self.search(domain).ids
+        child_ids = defaultdict(list)
+        for child in self.search([('parent_id', 'in', self.ids)]):
+            child_ids[child.parent_id.id].append(child.id)
+        for sequence in self:
+            sequence.child_ids = child_ids[sequence.id]
+
+    def _get_number_next_actual(self):
+        """ Inherit this method to give the number stored in number_next for the child sequences archived as idle,they
+        don't have PostgreSQL sequences anymore"""
+        archived = self.filtered('idle_archived')
+        for sequence in archived:
+            sequence.number_next_actual = sequence.number_next
+        super(IrSequence, self - archived)._get_number_next_actual()
+
+    def _compute_dynamic_metrics(self):
+        metrics = sequence_metrics.get_metrics(self._cr.dbname) if sequence_metrics.metrics_enabled() else {}
+        for sequence in self:
+            # next_by_code is measured by sequence code,the other phases by template
+            entries = [metrics[key] for key in (sequence.code, sequence.id) if key and key in metrics]
+            sequence.dynamic_metrics = '\n'.join(sequence_metrics.format_metrics(entry) for entry in entries) or False
+
+    @api.model
+    def _dump_dynamic_metrics(self):
+        """ Log the metrics collected by the current worker as JSON and return them,can be called by a scheduled action"""
+        metrics = sequence_metrics.get_metrics(self._cr.dbname)
+        _logger.info("Dynamic sequence metrics: %s", json.dumps(metrics, default=str))
+        return metrics
 
     def action_view_child_sequences(self):
-        return self._get_action_view_sequences(self.child_ids)
+        self.ensure_one()
+        if self.child_count == 1:
+            return self._get_action_view_sequences(self.search([('parent_id', '=', self.id)], limit=1))
+        # the children are not materialized,the list view will load them page by page
+        action = self._get_action_view_sequences(self.browse())
+        action['domain'] = [('parent_id', '=', self.id)]
+        return action
 
     def _get_action_view_sequences(self, sequences):
         action = self.env["ir.actions.actions"]._for_xml_id("base.ir_sequence_form")
@@ -81,6 +221,28 @@ class IrSequence(models.Model):
         action['context'] = dict(self._context, default_parent_id=self.id)
         return action
 
+    @api.constrains('implementation', 'number_block_size')
+    def _check_number_block_size(self):
+        for sequence in self:
+            if sequence.number_block_size > 1 and sequence.implementation != 'standard':
+                raise ValidationError(
+                    _("Numbers can be reserved by block only with the Standard implementation,a No gap sequence can not have gaps!"))
+
+    @api.constrains('storage_mode')
+    def _check_storage_mode(self):
+        """ The numbers already given by the child sequences (or counters) would be given again by the other storage"""
+        for sequence in self:
+            if sequence.storage_mode == 'counter' and self.with_context(active_test=False).search_count(
+                    [('parent_id', '=', sequence.id)]):
+                raise ValidationError(
+                    _("The storage mode can not be changed to Counters,the sequence template %s already has child sequences!")
+                    % sequence.name)
+            if sequence.storage_mode == 'sequence' and self.env['ir.sequence.counter'].sudo().search_count(
+                    [('sequence_id', '=', sequence.id)]):
+                raise ValidationError(
+                    _("The storage mode can not be changed to Child sequences,the sequence template %s already has counters!")
+                    % sequence.name)
+
     @api.constrains('sequence_type', 'related_model', 'dynamic_prefix_code', 'sequence_generator_code')
     def _check_dynamic_prefix_code(self):
         if self.sequence_type == 'sequence_template' and self.related_model:
@@ -111,15 +273,16 @@ class IrSequence(models.Model):
     @api.model
     def _parse_fields_for_check(self, dynamic_prefix_code):
         fields_list = self._parse_fields(dynamic_prefix_code, remove_static_fields=True)
-        # for the check purpose we need only the first field not the nested one
-        return [field.split(".")[0] for field in fields_list]
+        # for the check purpose we need only the first field not the nested one,without its padding
+        return [self._get_field_padding(field)[0].split(".")[0] for field in fields_list]
 
     @api.model
     def _parse_fields(self, dynamic_prefix_code, remove_static_fields=False):
         field_list = self._parse_dynamic_prefix_variable(dynamic_prefix_code)
         if not remove_static_fields:
             return field_list
-        field_list = [field for field in field_list if field not in self._parse_static_fields(dynamic_prefix_code)]
+        static_fields = set(self._parse_static_fields(dynamic_prefix_code))
+        field_list = [field for field in field_list if field not in static_fields]
         return field_list
 
     @api.model
@@ -138,119 +301,1173 @@ class IrSequence(models.Model):
         return fields_str.split(',')
 
     @api.model
+    @instrumented('next_by_code', key=lambda self, sequence_code, *args, **kwargs: sequence_code)
     def next_by_code(self, sequence_code, sequence_date=None):
         """ Inherit this method to request the template sequence if this is the case."""
         # we have to ovoid security check layer as this method must be executed without ACLs restrictions
         self = self.sudo()
-        company_id = self.env.company.id
-        # Here the sequence templates are with high priority in case there are sequences and sequence templates with the same code
-        # and after that the sequence templates will be ordered by the sequence field,this is because we rely on the assumption that
-        # if there are sequence template ,so the admin want the sequence to be managed dynamically
-        seq = self.search([('code', '=', sequence_code), ('company_id', 'in', [company_id, False])],
-                          order='sequence_type DESC,sequence ASC,company_id', limit=1)
+        seq_id = self._get_dynamic_sequence_id(sequence_code, self.env.company.id)
+        if not seq_id:
+            # plain sequence,nothing dynamic to compute
+            return super(IrSequence, self).next_by_code(sequence_code, sequence_date=sequence_date)
+        seq = self.browse(seq_id)
         suffix = False
+        eval_context = seq._get_dynamic_code_context()
         if seq.dynamic_suffix_code:
             # The suffix code is not used as unique element of sequence generation so if the value of some fields are null we have to proceed
-            suffix = seq._build_code(TYPE_DYNAMIC_SUFF_CODE,fields_check_strict=False)
+            suffix = seq._build_code(TYPE_DYNAMIC_SUFF_CODE,fields_check_strict=False, eval_context=eval_context)
             if not suffix:
                 raise ValidationError(
                     _("Some fields used to generate dynamic sequence prefix are not defined,can not proceed!"))
             if self.env.context.get('only_dynamic_suffix_code',False):
                 return suffix
-        if not seq:
-            return super(IrSequence, self).next_by_code(sequence_code, sequence_date=sequence_date)
         if seq.sequence_type == 'sequence':
             return super(IrSequence, self).next_by_code(sequence_code, sequence_date=sequence_date)
 
         # FIXME:this can have bad impact on performance since the forced_name is very rarely used,but the check will be done allways
         if not self.env.context.get('forced_name',False):
-            name = seq._next_by_sequence_template(sequence_code, sequence_date=sequence_date)
+            name = seq._next_by_sequence_template(sequence_code, sequence_date=sequence_date, eval_context=eval_context)
         else:
             name = self.env.context.get('forced_name')
         if suffix:
             name = '%s%s' % (name, suffix)
         return name
 
+    @api.model
+    @tools.ormcache('sequence_code', 'company_id')
+    def _get_dynamic_sequence_id(self, sequence_code, company_id):
+        """ Return the id of the sequence to use for sequence_code if it needs the dynamic behaviour of this module
+        (sequence template or dynamic suffix),False otherwise,the result is cached and invalidated each time a sequence
+        (other than a child sequence) is created,modified or deleted"""
+        # Here the sequence templates are with high priority in case there are sequences and sequence templates with the same code
+        # and after that the sequence templates will be ordered by the sequence field,this is because we rely on the assumption that
+        # if there are sequence template ,so the admin want the sequence to be managed dynamically
+        seq = self.sudo().search([('code', '=', sequence_code), ('company_id', 'in', [company_id, False])],
+                                 order='sequence_type DESC,sequence ASC,company_id', limit=1)
+        if seq.sequence_type == 'sequence_template' or seq.dynamic_suffix_code:
+            return seq.id
+        return False
+
+    @instrumented('next_by_id')
     def next_by_id(self, sequence_date=None):
         """ Inherit this method to request the template sequence if this is the case."""
         self.check_access_rights('read')
         if self.sequence_type == 'sequence':
             return super(IrSequence, self).next_by_id(sequence_date=sequence_date)
-        name = self._next_by_sequence_template(None, sequence_date=sequence_date)
+        eval_context = self._get_dynamic_code_context()
+        name = self._next_by_sequence_template(None, sequence_date=sequence_date, eval_context=eval_context)
         if self.dynamic_suffix_code:
             # The suffix code is not used as unique element of sequence generation so if the value of some fields are null we have to proceed
-            suffix = self._build_code(TYPE_DYNAMIC_SUFF_CODE,fields_check_strict=False)
+            suffix = self._build_code(TYPE_DYNAMIC_SUFF_CODE,fields_check_strict=False, eval_context=eval_context)
             if not suffix:
                 raise ValidationError(
                     _("Some fields used to generate dynamic sequence prefix are not defined,can not proceed!"))
             name = '%s %s' % (name, suffix)
         return name
 
-    def _next_by_sequence_template(self, sequence_code=None, sequence_date=None):
-        company_id = self.env.company.id
-        domain = [('company_id', 'in', [company_id, False])]
+    @instrumented('next_by_sequence_template')
+    def _next_by_sequence_template(self, sequence_code=None, sequence_date=None, eval_context=None):
+        if eval_context is None:
+            eval_context = self._get_dynamic_code_context()
+        resolution, value = self._resolve_sequence_template(eval_context=eval_context)
+        if resolution == 'name':
+            return value
+        if resolution == 'default':
+            if value.sequence_type == 'sequence':
+                return value._next(sequence_date=sequence_date)
+            return value._next_by_sequence_template(sequence_code, sequence_date=sequence_date)
+        if self.deferred_numbering:
+            return self._defer_next_by_child(value, eval_context.related_model, sequence_date=sequence_date)
+        return self._next_by_child(value, sequence_date=sequence_date)
+
+    def _next_by_child(self, key, sequence_date=None):
+        """ Return the next reference of the child sequence (or counter) of the template for key (prefix, generator_code)"""
+        return self._next_by_children({key: 1}, sequence_date=sequence_date)[key][0]
+
+    def _next_by_children(self, key_counts, sequence_date=None):
+        """
+        Return the references of the child sequences (or counters) of the template,the missing child sequences are
+        created.The numbers of a child sequence committed by a concurrent transaction after the start of this one are
+        taken in a new transaction committed immediately,it is not visible by this one (repeatable read),this is
+        refused for a No gap template since these numbers would be lost if this transaction was rolled back
+        :param key_counts (dict):(prefix, generator_code): number of references to generate with its child sequence
+        :return (dict):(prefix, generator_code): list of the references
+        """
+        if self.storage_mode == 'counter':
+            return {key: self._next_by_counter(key, count, sequence_date=sequence_date)
+                    for key, count in key_counts.items()}
+        children, concurrent_ids = self._get_or_create_child_sequences(list(key_counts))
+        references = self._next_by_child_sequences(
+            {key: child_id for key, child_id in children.items() if child_id not in concurrent_ids}, key_counts,
+            sequence_date=sequence_date)
+        if concurrent_ids:
+            if self.implementation == 'no_gap':
+                # the numbers taken in another transaction would be lost if this one was rolled back
+                raise UserError(_("The child sequences of %s have been created by a concurrent transaction,their "
+                                  "numbers can not be given without gap in this one,please retry!") % self.name)
+            with self._read_committed_env() as env:
+                references.update(self.with_env(env)._next_by_child_sequences(
+                    {key: child_id for key, child_id in children.items() if child_id in concurrent_ids}, key_counts,
+                    sequence_date=sequence_date))
+        return references
+
+    def _next_by_child_sequences(self, children, key_counts, sequence_date=None):
+        """ Return the references of the child sequences children (prefix, generator_code): id,see _next_by_children"""
+        if self.use_date_range and len(children) > 1:
+            # the date ranges missing for this date are copied to all the child sequences at once
+            dt = sequence_date or self._context.get('ir_sequence_date', fields.Date.today())
+            self.browse(children.values())._create_child_date_ranges(dt)
+        references = {}
+        for key, child_id in children.items():
+            child = self.browse(child_id)
+            if key_counts[key] == 1:
+                references[key] = [child._next(sequence_date=sequence_date)]
+            else:
+                references[key] = child._next_batch(key_counts[key], sequence_date=sequence_date)
+        return references
+
+    @contextlib.contextmanager
+    def _read_committed_env(self):
+        """ Yield the environment of a new transaction in read committed isolation,it sees the rows committed by the
+        concurrent transactions after the start of the current one,it is committed at the end of the block"""
+        with self.pool.cursor() as cr:
+            if not self.pool.in_test_mode():
+                cr.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+            yield self.env(cr=cr)
+
+    def _defer_next_by_child(self, key, related_model, sequence_date=None):
+        """
+        Return a provisional reference,the final one is taken from the child sequence of key at the commit of the
+        transaction by _assign_deferred_references and replaces the provisional one in the field deferred_field
+        (name by default) of the records of related_model,so the lock on the child sequence is held only during the commit
+        """
+        provisional_reference = '%s%s' % (DEFERRED_REFERENCE_PREFIX, uuid.uuid4().hex)
+        deferred_references = self._cr.precommit.data.get(DEFERRED_REFERENCES_KEY)
+        if deferred_references is None:
+            deferred_references = self._cr.precommit.data[DEFERRED_REFERENCES_KEY] = []
+            self._cr.precommit.add(self.browse()._assign_deferred_references)
+        deferred_references.append((self.id, key, provisional_reference, related_model,
+                                    self._context.get('deferred_field', 'name'), sequence_date,
+                                    self._context.get('ir_sequence_date')))
+        return provisional_reference
+
+    @api.model
+    def _assign_deferred_references(self):
+        """ Replace the provisional references given by _defer_next_by_child in this transaction in the order they have
+        been given,a number is taken only if a record (archived or not) still has the provisional reference so the
+        child sequences keep no gap.The records are found first with one query by model on the provisional references
+        of this transaction only,the numbers are then reserved in bulk by child sequence just before the last flush
+        so the lock of a No gap child sequence is held as short as possible"""
+        deferred_references = self._cr.precommit.data.pop(DEFERRED_REFERENCES_KEY, [])
+        if not deferred_references:
+            return
+        self.env['base'].flush()
+        provisional_length = len(deferred_references[0][2])
+        # (model, field): provisional references given for this field in the order they have been given
+        provisionals_by_field = defaultdict(list)
+        for entry in deferred_references:
+            provisionals_by_field[(entry[3], entry[4])].append(entry[2])
+        # (model, field): provisional reference: records having it
+        records_by_field = {}
+        for (model, field), provisionals in provisionals_by_field.items():
+            records = records_by_field[(model, field)] = defaultdict(lambda: self.env[model].sudo())
+            for chunk in tools.split_every(DEFERRED_SEARCH_CHUNK_SIZE, provisionals):
+                # the dynamic suffix may have been added after the provisional reference
+                domain = expression.OR([[(field, '=like', provisional + '%')] for provisional in chunk])
+                for record in self.env[model].sudo().with_context(active_test=False).search(domain, order='id'):
+                    records[record[field][:provisional_length]] |= record
+        # (template, sequence_date, ir_sequence_date): key: provisional references in the order they have been given
+        provisional_references = defaultdict(lambda: defaultdict(list))
+        for sequence_id, key, provisional_reference, model, field, sequence_date, ir_sequence_date in deferred_references:
+            if records_by_field[(model, field)].get(provisional_reference):
+                provisional_references[(sequence_id, sequence_date, ir_sequence_date)][key].append(
+                    (provisional_reference, model, field))
+        for (sequence_id, sequence_date, ir_sequence_date), references_by_key in provisional_references.items():
+            template = self.sudo().browse(sequence_id).with_context(ir_sequence_date=ir_sequence_date)
+            references = template._next_by_children(
+                {key: len(provisionals) for key, provisionals in references_by_key.items()}, sequence_date=sequence_date)
+            for key, provisionals in references_by_key.items():
+                for (provisional_reference, model, field), reference in zip(provisionals, references[key]):
+                    for record in records_by_field[(model, field)][provisional_reference]:
+                        record[field] = record[field].replace(provisional_reference, reference, 1)
+        self.env['base'].flush()
+
+    def _resolve_sequence_template(self, dynamic_prefix_fields=None, eval_context=None):
+        """
+        Evaluate the dynamic prefix and the sequence generator code of the template
+        :param dynamic_prefix_fields (dict):the values of the dynamic fields,taken from the context if not specified
+        :param eval_context (DynamicCodeContext):the values already resolved for this reference,if any
+        :return (tuple):('name', name) if the reference is the dynamic prefix itself,('default', sequence) if the
+        default sequence must be used,('child', (prefix, generator_code)) to identify the child sequence to use
+        """
         prefix, generator_code = False, False
+        if eval_context is None:
+            eval_context = self._get_dynamic_code_context(dynamic_prefix_fields)
         if self.dynamic_prefix_code:
-            prefix = self._build_code(TYPE_DYNAMIC_PREF_CODE)
+            prefix = self._build_code(TYPE_DYNAMIC_PREF_CODE, eval_context=eval_context)
             if not prefix:
                 # in the case we have default sequence to use
-                if self.default_sequence_id and self.default_sequence_id.sequence_type == 'sequence':
-                    return self.default_sequence_id._next(sequence_date=sequence_date)
-                elif self.default_sequence_id and self.default_sequence_id.sequence_type == 'sequence_template':
-                    return self.default_sequence_id._next_by_sequence_template(sequence_code,
-                                                                               sequence_date=sequence_date)
+                if self.default_sequence_id.sequence_type in ('sequence', 'sequence_template'):
+                    sequence_metrics.increment(self._cr.dbname, self.id, sequence_metrics.COUNTER_DEFAULT_FALLBACK)
+                    return 'default', self.default_sequence_id
                 raise ValidationError(
                     _("Some fields used to generate dynamic sequence prefix are not defined,can not proceed!"))
             if not self.generate_new_sequence:
-                return prefix
-            domain.append(('prefix', '=', prefix))
+                return 'name', prefix
         if self.sequence_generator_code:
-            generator_code = self._build_code(TYPE_CODE_GENERATOR)
+            generator_code = self._build_code(TYPE_CODE_GENERATOR, eval_context=eval_context)
             if not generator_code:
                 # in the case we have default sequence to use
-                if self.default_sequence_id and self.default_sequence_id.sequence_type == 'sequence':
-                    return self.default_sequence_id._next(sequence_date=sequence_date)
-                elif self.default_sequence_id and self.default_sequence_id.sequence_type == 'sequence_template':
-                    return self.default_sequence_id._next_by_sequence_template(sequence_code,
-                                                                               sequence_date=sequence_date)
+                if self.default_sequence_id.sequence_type in ('sequence', 'sequence_template'):
+                    sequence_metrics.increment(self._cr.dbname, self.id, sequence_metrics.COUNTER_DEFAULT_FALLBACK)
+                    return 'default', self.default_sequence_id
                 raise ValidationError(
                     _("Some fields used in the Sequence generator code are not defined,can not proceed!"))
-            domain.append(('generator_code', '=', generator_code))
-        if sequence_code:
-            domain.append(('code', '=', sequence_code))
-        seq_ids = self.search(domain, order='company_id')
-        if not seq_ids:
-            seq_ids |= self._create_sequence_from_template(prefix=prefix, generator_code=generator_code)
-        seq_id = seq_ids[0]
-        return seq_id._next(sequence_date=sequence_date)
+        return 'child', (prefix, generator_code)
+
+    @api.model
+    def next_by_code_batch(self, sequence_code, dynamic_prefix_fields_list, sequence_date=None):
+        """
+        Generate one reference for each dict of dynamic fields,the result is the same as calling next_by_code with
+        each dict as dynamic_prefix_fields in the context but the child sequences are resolved once for the batch and
+        the numbers of each child sequence are reserved in one statement
+        :param sequence_code (char):the code of the sequence
+        :param dynamic_prefix_fields_list (list):list of dicts of dynamic fields (see dynamic_prefix_fields)
+        :return (list):the references in the order of dynamic_prefix_fields_list
+        """
+        # we have to ovoid security check layer as this method must be executed without ACLs restrictions
+        self = self.sudo()
+        count = len(dynamic_prefix_fields_list)
+        seq_id = self._get_dynamic_sequence_id(sequence_code, self.env.company.id)
+        if seq_id:
+            seq = self.browse(seq_id)
+        else:
+            seq = self.search([('code', '=', sequence_code), ('company_id', 'in', [self.env.company.id, False])],
+                              order='company_id', limit=1)
+            if not seq:
+                return [super(IrSequence, self).next_by_code(sequence_code, sequence_date=sequence_date)] * count
+        suffixes = [False] * count
+        eval_contexts = [seq._get_dynamic_code_context(dynamic_prefix_fields)
+                         for dynamic_prefix_fields in dynamic_prefix_fields_list]
+        if seq.dynamic_suffix_code:
+            for index, eval_context in enumerate(eval_contexts):
+                # The suffix code is not used as unique element of sequence generation so if the value of some fields are null we have to proceed
+                suffixes[index] = seq._build_code(TYPE_DYNAMIC_SUFF_CODE, fields_check_strict=False,
+                                                  eval_context=eval_context)
+                if not suffixes[index]:
+                    raise ValidationError(
+                        _("Some fields used to generate dynamic sequence prefix are not defined,can not proceed!"))
+            if self.env.context.get('only_dynamic_suffix_code', False):
+                return suffixes
+        if seq.sequence_type == 'sequence':
+            return seq._next_batch(count, sequence_date=sequence_date)
+        if not self.env.context.get('forced_name', False):
+            names = seq._next_by_sequence_template_batch(sequence_code, dynamic_prefix_fields_list,
+                                                         sequence_date=sequence_date, eval_contexts=eval_contexts)
+        else:
+            names = [self.env.context.get('forced_name')] * count
+        return ['%s%s' % (name, suffix) if suffix else name for name, suffix in zip(names, suffixes)]
+
+    def _next_by_sequence_template_batch(self, sequence_code, dynamic_prefix_fields_list, sequence_date=None,
+                                         eval_contexts=None):
+        """ Batch version of _next_by_sequence_template,see next_by_code_batch"""
+        names = [False] * len(dynamic_prefix_fields_list)
+        default_indexes = []
+        # (prefix, generator_code) of the child sequence: indexes of the references to generate with it
+        child_indexes = {}
+        for index, dynamic_prefix_fields in enumerate(dynamic_prefix_fields_list):
+            resolution, value = self._resolve_sequence_template(
+                dynamic_prefix_fields=dynamic_prefix_fields, eval_context=eval_contexts and eval_contexts[index])
+            if resolution == 'name':
+                names[index] = value
+            elif resolution == 'default':
+                default_indexes.append(index)
+            else:
+                child_indexes.setdefault(value, []).append(index)
+        if default_indexes:
+            if self.default_sequence_id.sequence_type == 'sequence':
+                default_names = self.default_sequence_id._next_batch(len(default_indexes), sequence_date=sequence_date)
+            else:
+                default_names = self.default_sequence_id._next_by_sequence_template_batch(
+                    sequence_code, [dynamic_prefix_fields_list[index] for index in default_indexes],
+                    sequence_date=sequence_date)
+            for index, name in zip(default_indexes, default_names):
+                names[index] = name
+        if child_indexes and self.deferred_numbering:
+            related_model = self._get_dynamic_code_context().related_model
+            for key, indexes in child_indexes.items():
+                for index in indexes:
+                    names[index] = self._defer_next_by_child(key, related_model, sequence_date=sequence_date)
+        elif child_indexes:
+            references = self._next_by_children({key: len(indexes) for key, indexes in child_indexes.items()},
+                                                sequence_date=sequence_date)
+            for key, indexes in child_indexes.items():
+                for index, name in zip(indexes, references[key]):
+                    names[index] = name
+        return names
+
+    def _next_by_counter(self, key, count=1, sequence_date=None):
+        """
+        Same result as calling count times _next on the child sequence (prefix, generator_code) of the template,but the
+        numbers are taken from the counter of the key in ir.sequence.counter instead of a child sequence
+        :return (list):the references
+        """
+        prefix, generator_code = key
+        # the child sequence is not saved,it is only used to format the numbers exactly as a real child sequence
+        seq = self.new({'prefix': prefix, 'sequence_type': 'sequence'}, origin=self)
+        date_from, date_to, number_next = False, False, 1
+        if self.use_date_range:
+            dt = sequence_date or self._context.get('ir_sequence_date', fields.Date.today())
+            date_from, date_to, number_next = self._get_counter_date_range(dt)
+            seq = seq.with_context(ir_sequence_date_range=date_from)
+        numbers = self.env['ir.sequence.counter'].sudo()._reserve_numbers(
+            self, prefix, generator_code, date_from, date_to, number_next, count)
+        interpolated_prefix, interpolated_suffix = seq._get_prefix_suffix()
+        return [interpolated_prefix + '%%0%sd' % seq.padding % number + interpolated_suffix for number in numbers]
+
+    def _get_counter_date_range(self, dt):
+        """
+        Return the date range of the counters for the date dt: the date range of the template containing dt (a child
+        sequence copies it the first time it is used in this range),otherwise the yearly range _create_date_range_seq would create
+        :return (tuple):date_from,date_to and the first number of the counter
+        """
+        dt = fields.Date.to_date(dt)
+        date_range = self.env['ir.sequence.date_range'].search(
+            [('sequence_id', '=', self.id), ('date_from', '<=', dt), ('date_to', '>=', dt)], limit=1)
+        if date_range:
+            return date_range.date_from, date_range.date_to, date_range.number_next_actual
+        date_from, date_to = self._get_yearly_date_range(dt, self)
+        return date_from, date_to, 1
+
+    @api.model
+    def _get_yearly_date_range(self, dt, sequences):
+        """ Return the dates of the yearly range containing dt created by _create_date_range_seq,shortened so it
+        overlaps none of the date ranges of sequences (a child sequence and its template for instance)
+        :return (tuple):date_from,date_to
+        """
+        date_range_obj = self.env['ir.sequence.date_range'].sudo()
+        date_from, date_to = dt.replace(month=1, day=1), dt.replace(month=12, day=31)
+        date_range = date_range_obj.search(
+            [('sequence_id', 'in', sequences.ids), ('date_from', '>=', dt), ('date_from', '<=', date_to)],
+            order='date_from', limit=1)
+        if date_range:
+            date_to = date_range.date_from - datetime.timedelta(days=1)
+        date_range = date_range_obj.search(
+            [('sequence_id', 'in', sequences.ids), ('date_to', '>=', date_from), ('date_to', '<=', dt)],
+            order='date_to desc', limit=1)
+        if date_range:
+            date_from = date_range.date_to + datetime.timedelta(days=1)
+        return date_from, date_to
+
+    def action_backfill_child_sequences(self):
+        """ Resync the child sequences (or counters) of the template with the references of the existing records,the
+        field containing the references is name unless backfill_reference_field is given in the context"""
+        self.ensure_one()
+        report = self._backfill_child_sequences(self._context.get('backfill_reference_field', 'name'))
+        actions = [line['action'] for line in report]
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Child sequences resynchronized'),
+                'message': _('%s created,%s advanced,%s unchanged') % (
+                    actions.count('created'), actions.count('advanced'), actions.count('unchanged')),
+                'sticky': False,
+            },
+        }
+
+    def _backfill_child_sequences(self, reference_field='name'):
+        """
+        Compute with one aggregated query the prefix/generator code of every existing record of the related model and
+        the greatest number used in their references,then create or advance in bulk the child sequences (or counters)
+        so the next numbers never collide with the existing references
+        :param reference_field (char):the field of the related model containing the references
+        :return (list):one dict by prefix/generator code with the keys prefix,generator_code,max_number,
+        number_next_before (False for a created child),number_next and action (created,advanced or unchanged)
+        """
+        self.ensure_one()
+        if self.sequence_type != 'sequence_template' or not self.generate_new_sequence:
+            raise UserError(_("Only the sequence templates generating sequences by format can be resynchronized!"))
+        if self.use_date_range:
+            raise UserError(_("The resynchronization of sequence templates using date ranges is not supported!"))
+        related_model = self._get_dynamic_code_context().related_model
+        if not related_model:
+            raise UserError(_("No related model detected,can not build dynamic sequence!"))
+        model = self.env[related_model].with_context(active_test=False)
+        field = model._fields.get(reference_field)
+        if not field or field.type != 'char' or not field.store:
+            raise UserError(_('No field %s detected in model %s') % (reference_field, related_model))
+        # path of the many2one chain: (alias, alias of the table holding the many2one, many2one column, joined table)
+        joins, params = {}, []
+        prefix_sql, generator_code_sql = 'NULL::varchar', 'NULL::varchar'
+        conditions = ['keys.reference IS NOT NULL']
+        if self.dynamic_prefix_code:
+            prefix_sql = self._get_code_sql(TYPE_DYNAMIC_PREF_CODE, model, joins, params)
+            conditions.append('keys.prefix IS NOT NULL')
+        if self.sequence_generator_code:
+            generator_code_sql = self._get_code_sql(TYPE_CODE_GENERATOR, model, joins, params)
+            conditions.append('keys.generator_code IS NOT NULL')
+        dynamic_suffix_sql = "''"
+        if self.dynamic_suffix_code:
+            # the dynamic suffix is added after the reference by next_by_code,without separator
+            dynamic_suffix_sql = self._get_code_sql(TYPE_DYNAMIC_SUFF_CODE, model, joins, params,
+                                                    fields_check_strict=False)
+        company_sql = ''
+        company_field = model._fields.get('company_id')
+        if self.company_id and company_field and company_field.type == 'many2one' and company_field.store:
+            # the child sequences of a template belong to its company,the references of the other companies are ignored
+            company_sql = ' WHERE t0.company_id = %s OR t0.company_id IS NULL'
+            params.append(self.company_id.id)
+        joins_sql = ''.join(' LEFT JOIN "%s" %s ON %s.id = %s."%s"' % (table, alias, alias, lhs_alias, column)
+                            for alias, lhs_alias, column, table in joins.values())
+        self.env['base'].flush()
+        # the number is made of the digits between the prefix of the child sequence and the suffixes in the reference,
+        # the digits of the suffixes are never taken as part of the number
+        self._cr.execute("""
+            SELECT keys.prefix, keys.generator_code,
+                   MAX(SUBSTRING(SUBSTRING(keys.reference FROM COALESCE(LENGTH(keys.prefix), 0) + 1
+                                           FOR GREATEST(LENGTH(keys.reference) - COALESCE(LENGTH(keys.prefix), 0)
+                                                        - LENGTH(keys.dynamic_suffix), 0))
+                                 FROM %s)::numeric)
+            FROM (SELECT {prefix} AS prefix, {generator_code} AS generator_code, {dynamic_suffix} AS dynamic_suffix,
+                         t0."{reference}" AS reference
+                  FROM "{table}" t0{joins}{company}) keys
+            WHERE {conditions} AND LEFT(keys.reference, COALESCE(LENGTH(keys.prefix), 0)) = COALESCE(keys.prefix, '')
+            AND RIGHT(keys.reference, LENGTH(keys.dynamic_suffix)) = keys.dynamic_suffix
+            GROUP BY keys.prefix, keys.generator_code
+        """.format(prefix=prefix_sql, generator_code=generator_code_sql, dynamic_suffix=dynamic_suffix_sql,
+                   reference=field.name, table=model._table, joins=joins_sql, company=company_sql,
+                   conditions=' AND '.join(conditions)), ['^([0-9]+)%s$' % self._get_suffix_pattern()] + params)
+        numbers_next = {(prefix or False, generator_code or False): int(max_number) + self.number_increment
+                        for prefix, generator_code, max_number in self._cr.fetchall() if max_number is not None}
+        too_big = [key for key, number_next in numbers_next.items() if number_next > MAX_NUMBER_NEXT]
+        if too_big:
+            raise UserError(_("The numbers of the references of %s exceed the greatest number of a sequence (%s)!") % (
+                ','.join(''.join(part for part in key if part) for key in too_big), MAX_NUMBER_NEXT))
+        if self.storage_mode == 'counter':
+            report = self.env['ir.sequence.counter'].sudo()._advance_counters(self, numbers_next)
+        else:
+            report = self._advance_child_sequences(numbers_next)
+        _logger.info("Resynchronization of the sequence template %s: %s", self.id,
+                     json.dumps(report, default=str))
+        return report
+
+    def _get_suffix_pattern(self):
+        """ Return the regular expression (PostgreSQL syntax) matching the suffix of the template once interpolated by
+        _get_prefix_suffix,whatever the date"""
+        patterns, placeholders = [], {}
+        for key, digits in INTERPOLATED_DATE_DIGITS.items():
+            for name in (key, 'range_' + key, 'current_' + key):
+                placeholders[name] = '\x00%s\x00' % len(patterns)
+                patterns.append('[0-9]{%s}' % digits)
+        try:
+            suffix = (self.suffix or '') % placeholders
+        except (ValueError, KeyError):
+            raise UserError(_("Invalid prefix or suffix for sequence '%s'") % self.name)
+        # the odd parts are the indexes of the interpolated date values
+        return ''.join(patterns[int(part)] if index % 2 else re.escape(part)
+                       for index, part in enumerate(suffix.split('\x00')))
+
+    def _get_code_sql(self, code_type, model, joins, params, fields_check_strict=True):
+        """
+        Return the SQL expression computing the code code_type of the template for the records of model (table alias
+        t0),the expression is NULL where _build_code would return False
+        :param joins (dict):the joins of the many2one chains,completed with the joins needed by this code
+        :param params (list):completed with the parameters of the expression
+        :param fields_check_strict (bool):if False the undefined values are empty as in _build_code
+        """
+        parts = []
+        for token in self._get_code_plan(code_type, model._name):
+            if not token.field_name:
+                parts.append('%s::varchar')
+                params.append(token.static_value)
+                continue
+            if token.field_type != 'many2one':
+                parts.append(self._get_field_value_sql('t0', model._fields[token.field_name], token.padding))
+                if not fields_check_strict:
+                    parts[-1] = "COALESCE(%s, '')" % parts[-1]
+                continue
+            # many2one chain: join the tables of all the fields but the last one
+            path = token.path.split('.')
+            alias, current_model = 't0', model
+            for index, field_name in enumerate(path[:-1]):
+                field = current_model._fields.get(field_name)
+                if not field or field.type != 'many2one' or not field.store:
+                    raise UserError(_("The field %s can not be used to resynchronize the child sequences!") % token.path)
+                join_path = '.'.join(path[:index + 1])
+                current_model = self.env[field.comodel_name]
+                if join_path not in joins:
+                    joins[join_path] = ('t%s' % (len(joins) + 1), alias, field.name, current_model._table)
+                alias = joins[join_path][0]
+            field = current_model._fields.get(path[-1])
+            if len(path) == 1 or not field or field.type in ('many2one', 'one2many', 'many2many'):
+                raise UserError(_("The field %s can not be used to resynchronize the child sequences!") % token.path)
+            parts.append(self._get_field_value_sql(alias, field, 0, nested=True))
+            if not fields_check_strict:
+                parts[-1] = "COALESCE(%s, '')" % parts[-1]
+        return ' || '.join(parts) or "''"
+
+    @api.model
+    def _get_field_value_sql(self, alias, field, padding, nested=False):
+        """ Return the SQL expression of the text of the value of field as written by _render_code_plan (or by
+        _parse_many2one_field if nested),NULL if the value would make the code undefined"""
+        column = '%s."%s"' % (alias, field.name)
+        if not field.store:
+            raise UserError(_("The field %s can not be used to resynchronize the child sequences!") % field.name)
+        if field.type in ('char', 'text', 'selection', 'html'):
+            return "NULLIF(%s, '')" % column
+        if field.type == 'integer':
+            if nested:
+                # 0 is kept in a many2one chain but the chain is undefined if the joined record doesn't exist
+                return "(CASE WHEN %s.id IS NOT NULL THEN COALESCE(%s, 0)::text END)" % (alias, column)
+            value = 'NULLIF(%s, 0)::text' % column
+            if not padding:
+                return value
+            return "(CASE WHEN LENGTH({value}) >= {padding} THEN {value} ELSE LPAD({value}, {padding}, '0') END)".format(
+                value=value, padding=int(padding))
+        if field.type == 'boolean':
+            # a null boolean is False for the ORM,False is kept in a many2one chain
+            if nested:
+                return "(CASE WHEN %s.id IS NOT NULL THEN (CASE WHEN %s THEN 'True' ELSE 'False' END) END)" % (
+                    alias, column)
+            return "(CASE WHEN %s THEN 'True' END)" % column
+        if field.type == 'date':
+            return '%s::text' % column
+        if field.type == 'datetime':
+            return "TO_CHAR(%s, 'YYYY-MM-DD HH24:MI:SS')" % column
+        raise UserError(_("The field %s can not be used to resynchronize the child sequences!") % field.name)
+
+    def _advance_child_sequences(self, numbers_next):
+        """
+        Create the missing child sequences and advance the existing ones to the numbers of numbers_next,the numbers are
+        never decreased.The child sequences are neither restored nor marked as used,those archived as idle are advanced
+        in the column number_next only
+        :param numbers_next (dict):(prefix, generator_code): the minimal next number of the child sequence
+        :return (list):see _backfill_child_sequences
+        """
+        if not numbers_next:
+            return []
+        self.flush()
+        # the insertion of a child sequence locks its template (foreign key),so the child sequences created by the
+        # concurrent transactions are committed before this point or wait for the end of this transaction
+        self._cr.execute("SELECT id FROM ir_sequence WHERE id = %s FOR UPDATE", [self.id])
+        children = self._read_child_sequences()
+        missing_keys = [key for key in numbers_next if key not in children]
+        created, concurrent = {}, {}
+        if missing_keys:
+            created, concurrent = self._create_child_sequences(missing_keys)
+            template = self.sudo()
+            children.update({key: (child_id, template.implementation, False, 1, template.number_increment)
+                             for key, child_id in created.items()})
+        numbers_before = self._set_child_numbers_next(
+            {key: children[key] for key in numbers_next if key in children}, numbers_next)
+        if concurrent:
+            with self._read_committed_env() as env:
+                template = self.with_env(env)
+                concurrent_children = template._read_child_sequences()
+                numbers_before.update(template._set_child_numbers_next(
+                    {key: concurrent_children[key] for key in concurrent}, numbers_next))
+        report = []
+        for key, number_next in numbers_next.items():
+            number_next_before = numbers_before[key]
+            report.append({
+                'prefix': key[0],
+                'generator_code': key[1],
+                'max_number': number_next - self.number_increment,
+                'number_next_before': key not in created and number_next_before,
+                'number_next': max(number_next_before, number_next),
+                'action': key in created and 'created' or number_next_before < number_next and 'advanced'
+                or 'unchanged',
+            })
+        return report
+
+    def _read_child_sequences(self):
+        """ Read in one query the child sequences of the template for the company of the environment (or without
+        company),as _search_child_sequence_id finds them
+        :return (dict):(prefix, generator_code): (id, implementation, idle_archived, number_next, number_increment)
+        """
+        self._cr.execute("""
+            SELECT prefix, generator_code, id, implementation, idle_archived, number_next, number_increment
+            FROM ir_sequence WHERE parent_id = %s AND (company_id = %s OR company_id IS NULL)
+            ORDER BY company_id
+        """, (self.id, self.env.company.id))
+        children = {}
+        for prefix, generator_code, *child in self._cr.fetchall():
+            children.setdefault((prefix or False, generator_code or False), tuple(child))
+        return children
+
+    def _set_child_numbers_next(self, children, numbers_next):
+        """
+        Advance in bulk the child sequences children (see _read_child_sequences) to the numbers of numbers_next when
+        they are greater than their next numbers
+        :return (dict):(prefix, generator_code): the next number of the child sequence before being advanced
+        """
+        pg_sequences = {key: ('ir_sequence_%03d' % child_id, number_increment)
+                        for key, (child_id, implementation, idle_archived, number_next, number_increment)
+                        in children.items() if implementation == 'standard' and not idle_archived}
+        numbers_before = {key: child[3] for key, child in children.items()}
+        numbers_before.update(self._read_pg_sequences(pg_sequences))
+        advanced = {key: numbers_next[key] for key in children if numbers_before[key] < numbers_next[key]}
+        if not advanced:
+            return numbers_before
+        standard_keys = [key for key in advanced if key in pg_sequences]
+        if standard_keys:
+            self._cr.execute("SELECT setval(name::regclass, number_next, false) "
+                             "FROM unnest(%s::text[], %s::bigint[]) AS v(name, number_next)",
+                             ([pg_sequences[key][0] for key in standard_keys], [advanced[key] for key in standard_keys]))
+        # the write date is updated to discard the blocks of numbers reserved by the workers (number_block_size)
+        child_ids = [children[key][0] for key in advanced]
+        self._cr.execute("""
+            UPDATE ir_sequence SET number_next = v.number_next, write_date = (now() at time zone 'UTC')
+            FROM unnest(%s::integer[], %s::integer[]) AS v(id, number_next)
+            WHERE ir_sequence.id = v.id
+        """, (child_ids, list(advanced.values())))
+        self.browse(child_ids).invalidate_cache(['number_next', 'number_next_actual', 'write_date'])
+        return numbers_before
+
+    def _get_numbers_next(self):
+        """ Return the next number of each sequence (without date range) read in bulk,the PostgreSQL sequences of the
+        Standard implementation are read by chunks of 1000 in one query by chunk
+        :return (dict):id: next number
+        """
+        numbers_next = {sequence.id: sequence.number_next for sequence in self}
+        standard_sequences = self.filtered(lambda sequence: sequence.implementation == 'standard')
+        numbers_next.update(self._read_pg_sequences(
+            {sequence.id: ('ir_sequence_%03d' % sequence.id, sequence.number_increment)
+             for sequence in standard_sequences}))
+        return numbers_next
+
+    @api.model
+    def _read_pg_sequences(self, pg_sequences):
+        """
+        Read the next numbers of PostgreSQL sequences by chunks of 1000 in one query by chunk
+        :param pg_sequences (dict):key: (name of the PostgreSQL sequence, increment)
+        :return (dict):key: next number
+        """
+        numbers_next = {}
+        keys = list(pg_sequences)
+        for chunk_keys in tools.split_every(1000, keys):
+            self._cr.execute(' UNION ALL '.join(
+                "SELECT %s, last_value, is_called FROM %s" % (index, pg_sequences[key][0])
+                for index, key in enumerate(chunk_keys)))
+            for index, last_value, is_called in self._cr.fetchall():
+                key = chunk_keys[index]
+                numbers_next[key] = last_value + pg_sequences[key][1] if is_called else last_value
+        return numbers_next
+
+    def _next_batch(self, count, sequence_date=None):
+        """ Same result as calling _next count times on a plain sequence,but the numbers are reserved in one statement"""
+        self.ensure_one()
+        if self.idle_archived:
+            self._revive_idle_sequences()
+        if self.implementation == 'standard' and self.number_block_size > 1:
+            # the numbers are taken from the blocks of this worker as _next does
+            numbers, date_from = self._get_preallocated_numbers(count, sequence_date=sequence_date)
+            seq = self.with_context(ir_sequence_date_range=date_from) if date_from else self
+        else:
+            date_range = self._get_next_date_range(sequence_date)
+            seq = self.with_context(ir_sequence_date_range=date_range.date_from) if date_range else self
+            numbers = self._reserve_numbers(count, date_range=date_range)
+        interpolated_prefix, interpolated_suffix = seq._get_prefix_suffix()
+        return [interpolated_prefix + '%%0%sd' % seq.padding % number + interpolated_suffix for number in numbers]
+
+    def _next(self, sequence_date=None):
+        """ Inherit this method to give the numbers from the block reserved by this worker if this is the case,and to
+        restore the child sequence if it has been archived as idle."""
+        if self.idle_archived:
+            self._revive_idle_sequences()
+        if self.implementation != 'standard' or self.number_block_size <= 1 and not self.parent_id:
+            return super(IrSequence, self)._next(sequence_date=sequence_date)
+        if self.number_block_size <= 1:
+            # the PostgreSQL sequences of a child sequence may be dropped by an archive,see _reserve_numbers
+            return self._next_batch(1, sequence_date=sequence_date)[0]
+        numbers, date_from = self._get_preallocated_numbers(1, sequence_date=sequence_date)
+        seq = self.with_context(ir_sequence_date_range=date_from) if date_from else self
+        return seq.get_next_char(numbers[0])
+
+    def _get_next_date_range(self, sequence_date=None):
+        """ Return the date range used by _next for sequence_date (created if missing),empty if no date range is used"""
+        if not self.use_date_range:
+            return self.env['ir.sequence.date_range']
+        dt = sequence_date or self._context.get('ir_sequence_date', fields.Date.today())
+        seq_date = self.env['ir.sequence.date_range'].search(
+            [('sequence_id', '=', self.id), ('date_from', '<=', dt), ('date_to', '>=', dt)], limit=1)
+        if not seq_date:
+            seq_date = self._create_date_range_seq(dt)
+        return seq_date
+
+    def _create_date_range_seq(self, date):
+        """ Inherit this method to copy in the child sequence only the date range of its template containing date,the
+        yearly date range of the base module is created if the template has no date range for this date,without
+        overlapping the date ranges of the template copied later in the child sequence"""
+        if not self.parent_id:
+            return super(IrSequence, self)._create_date_range_seq(date)
+        date_ranges = self._create_child_date_ranges(date)
+        if date_ranges:
+            return date_ranges
+        date_from, date_to = self._get_yearly_date_range(fields.Date.to_date(date), self.parent_id | self)
+        return self.env['ir.sequence.date_range'].sudo().create({
+            'date_from': date_from,
+            'date_to': date_to,
+            'sequence_id': self.id,
+        })
+
+    def _create_child_date_ranges(self, date):
+        """
+        Copy in one multi-row insert the date range of the template containing date to the child sequences of self
+        which don't have a date range for this date yet,all the child sequences must have the same template
+        :return (ir.sequence.date_range):the date ranges created,empty if the template has no date range for date
+        """
+        date_range_obj = self.env['ir.sequence.date_range'].sudo()
+        template = self.parent_id
+        template.ensure_one()
+        template_range = date_range_obj.search(
+            [('sequence_id', '=', template.id), ('date_from', '<=', date), ('date_to', '>=', date)], limit=1)
+        if not template_range:
+            return date_range_obj
+        children = self - date_range_obj.search(
+            [('sequence_id', 'in', self.ids), ('date_from', '<=', date), ('date_to', '>=', date)]).sequence_id
+        if not children:
+            return date_range_obj
+        number_next = template_range.number_next_actual
+        self.env['base'].flush()
+        self._cr.execute("""
+            INSERT INTO ir_sequence_date_range
+                (sequence_id, date_from, date_to, number_next, create_uid, create_date, write_uid, write_date)
+            SELECT child_id, %s, %s, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+            FROM unnest(%s::integer[]) AS child_id
+            RETURNING id, sequence_id
+        """, (template_range.date_from, template_range.date_to, number_next, self.env.uid, self.env.uid, children.ids))
+        rows = self._cr.fetchall()
+        for date_range_id, child_id in rows:
+            if self.browse(child_id).implementation == 'standard':
+                _create_sequence(self._cr, 'ir_sequence_%03d_%03d' % (child_id, date_range_id),
+                                 self.browse(child_id).number_increment, number_next)
+        children.invalidate_cache(['date_range_ids'])
+        return date_range_obj.browse([date_range_id for date_range_id, child_id in rows])
+
+    def _get_preallocated_numbers(self, count, sequence_date=None):
+        """
+        Return count numbers from the block of number_block_size numbers reserved by this worker for the sequence (or
+        for its date range containing the date),the blocks are found without query by the start of their date range and
+        are valid while the sequence is not modified,the next blocks are reserved in one statement when it is exhausted
+        :return (tuple):the numbers and the start of their date range (False if no date range is used)
+        """
+        dt = False
+        if self.use_date_range:
+            dt = fields.Date.to_date(sequence_date or self._context.get('ir_sequence_date') or fields.Date.today())
+        numbers, date_from = [], None
+        with _number_blocks_lock:
+            blocks = _number_blocks.setdefault((self._cr.dbname, self.id), {})
+            for block_date_from in [key for key, block in blocks.items() if block[0] != self.write_date]:
+                del blocks[block_date_from]
+            date_from = next((block_date_from for block_date_from, (write_date, date_to, block) in blocks.items()
+                              if not dt or block_date_from <= dt <= date_to), None)
+            if date_from is not None:
+                block = blocks[date_from][2]
+                while block and len(numbers) < count:
+                    numbers.append(block.popleft())
+        missing = count - len(numbers)
+        if not missing:
+            return numbers, date_from
+        date_range = self._get_next_date_range(sequence_date)
+        size = -(-missing // self.number_block_size) * self.number_block_size
+        block = deque(self._reserve_numbers(size, date_range=date_range))
+        numbers += [block.popleft() for index in range(missing)]
+        date_from = date_range.date_from or False
+        with _number_blocks_lock:
+            _number_blocks.setdefault((self._cr.dbname, self.id), {})[date_from] = (
+                self.write_date, date_range.date_to or False, block)
+        return numbers, date_from
+
+    def _discard_number_blocks(self):
+        """ Discard the blocks of numbers reserved by the workers for the sequences,the blocks of this worker at once
+        and those of the other workers by the write date of the sequences (see _get_preallocated_numbers)"""
+        sequences = self.filtered(lambda sequence: sequence.number_block_size > 1)
+        if not sequences:
+            return
+        with _number_blocks_lock:
+            for sequence in sequences:
+                _number_blocks.pop((self._cr.dbname, sequence.id), None)
+        self._cr.execute("UPDATE ir_sequence SET write_date = (now() at time zone 'UTC') WHERE id IN %s",
+                         [tuple(sequences.ids)])
+        sequences.invalidate_cache(['write_date'])
+
+    def _reserve_numbers(self, count, date_range=None):
+        """
+        Reserve count consecutive numbers of the sequence (or of its date_range) in one statement
+        :return (list):the reserved numbers
+        """
+        if self.implementation == 'standard':
+            if date_range:
+                seq_name = 'ir_sequence_%03d_%03d' % (self.id, date_range.id)
+            else:
+                seq_name = 'ir_sequence_%03d' % self.id
+            if not self.parent_id:
+                self._cr.execute("SELECT nextval(%s) FROM generate_series(1, %s)", (seq_name, count))
+                return [row[0] for row in self._cr.fetchall()]
+            # the archive of the child sequence committed after the start of this transaction has dropped its
+            # PostgreSQL sequence,the catalog is not read in the snapshot so to_regclass gives null instead of an
+            # error,the child sequence is then restored and the numbers are reserved again
+            for attempt in range(2):
+                self._cr.execute("SELECT nextval(to_regclass(%s)) FROM generate_series(1, %s)", (seq_name, count))
+                numbers = [row[0] for row in self._cr.fetchall()]
+                if None not in numbers:
+                    return numbers
+                if not attempt:
+                    _logger.info("PostgreSQL sequence %s dropped by an archive,child sequence %s restored",
+                                 seq_name, self.id)
+                    self._revive_idle_sequences()
+            raise UserError(_("The PostgreSQL sequence %s of the sequence %s does not exist!") % (seq_name, self.name))
+        target = date_range or self
+        self._cr.execute("UPDATE %s SET number_next = number_next + %%s WHERE id = %%s RETURNING number_next"
+                         % target._table, (self.number_increment * count, target.id))
+        number_next = self._cr.fetchone()[0] - self.number_increment * count
+        target.invalidate_cache(['number_next'], target.ids)
+        return [number_next + index * self.number_increment for index in range(count)]
+
+    def _get_child_sequence_id(self, company_id, prefix, generator_code):
+        """ Return the id of the child sequence created by this template for this prefix and generator code,only the
+        child sequences found are cached so the creation of a child sequence needs no invalidation"""
+        key = (company_id, prefix, generator_code)
+        child_id = self._get_child_sequence_cache().get(key)
+        if not child_id:
+            child_id = self._cr.postcommit.data.get(CHILD_IDS_KEY, {}).get((self.id,) + key)
+        if not child_id:
+            child_id = self._search_child_sequence_id(company_id, prefix, generator_code)
+            if child_id:
+                self._cache_child_sequence_id(key, child_id)
+        return child_id
+
+    def _get_child_sequence_cache(self):
+        """ Return the dict (company_id, prefix, generator_code): id of the child sequences of the template found by
+        the committed transactions of this worker,it is never invalidated by the other workers so the ids are checked
+        against the child sequences read (see _get_or_create_child_sequences)"""
+        return _child_sequence_ids.setdefault((self._cr.dbname, self.id), {})
+
+    def _cache_child_sequence_id(self, key, child_id):
+        """ Add the child sequence to the cache after the commit of the transaction,a child sequence created by a
+        transaction rolled back must never be cached"""
+        child_ids = self._cr.postcommit.data.get(CHILD_IDS_KEY)
+        if child_ids is None:
+            child_ids = self._cr.postcommit.data[CHILD_IDS_KEY] = {}
+            self._cr.postcommit.add(self.browse()._store_child_sequence_ids)
+        child_ids[(self.id,) + key] = child_id
+
+    @api.model
+    def _store_child_sequence_ids(self):
+        for (template_id, company_id, prefix, generator_code), child_id in \
+                self._cr.postcommit.data.pop(CHILD_IDS_KEY, {}).items():
+            self.browse(template_id)._get_child_sequence_cache()[(company_id, prefix, generator_code)] = child_id
+
+    def _search_child_sequence_id(self, company_id, prefix, generator_code):
+        domain = [('parent_id', '=', self.id), ('company_id', 'in', [company_id, False]),
+                  ('prefix', '=', prefix), ('generator_code', '=', generator_code)]
+        # the child sequences archived as idle are found too,they are restored by _get_or_create_child_sequences
+        return self.sudo().with_context(active_test=False).search(domain, order='company_id', limit=1).id
+
+    def _get_or_create_child_sequences(self, keys):
+        """
+        Return the ids of the child sequences of the template for each (prefix, generator_code) of keys,the missing
+        ones are created
+        :return (tuple):the dict (prefix, generator_code): id of the child sequence and the set of the ids of the child
+        sequences created by a concurrent transaction,they are not visible by this transaction
+        """
+        company_id = self.env.company.id
+        children = {key: self._get_child_sequence_id(company_id, *key) for key in keys}
+        found = self.sudo().browse({child_id for child_id in children.values() if child_id})
+        try:
+            # the child sequences are read by the ORM as _next reads them anyway,so the cached ids cost no query
+            found.mapped('idle_archived')
+        except MissingError:
+            # cached after the commit of a transaction which ended after the start of this one (or deleted)
+            found = found.exists()
+        for key, child_id in children.items():
+            child = self.sudo().browse(child_id)
+            if not child_id or child in found and child.parent_id.id == self.id and \
+                    child.company_id.id in (company_id, False) and \
+                    (child.prefix or False, child.generator_code or False) == key:
+                continue
+            # the child sequence has been modified or is not visible,it is searched again
+            self._get_child_sequence_cache().pop((company_id,) + key, None)
+            children[key] = self._get_child_sequence_id(company_id, *key)
+        archived_ids = {child_id for child_id in children.values()
+                        if child_id and self.sudo().browse(child_id).idle_archived}
+        missing_keys = [key for key, child_id in children.items() if not child_id]
+        concurrent_ids = set()
+        if missing_keys:
+            created, concurrent = self._create_child_sequences(missing_keys)
+            children.update(created)
+            children.update(concurrent)
+            concurrent_ids = set(concurrent.values())
+        if archived_ids:
+            self.sudo().browse(archived_ids)._revive_idle_sequences()
+        self.sudo().browse(set(children.values()) - concurrent_ids)._mark_as_used()
+        return children, concurrent_ids
+
+    def _create_child_sequences(self, keys):
+        """
+        Create the child sequences of the template for keys.When a concurrent transaction creates the same child
+        sequence,the insertion waits for its end (unique index ir_sequence_child_key_uniq) and fails if it commits,the
+        child sequence of the concurrent transaction is then reused instead of replaying the transaction
+        :return (tuple):the dicts (prefix, generator_code): id of the child sequences created by this transaction and
+        of those created by concurrent transactions
+        """
+        company_id = self.env.company.id
+        created, concurrent = {}, {}
+        # the keys are inserted in the same order by all the transactions to avoid the deadlocks between two batches
+        missing_keys = sorted(keys, key=lambda key: (key[0] or '', key[1] or ''))
+        while missing_keys:
+            try:
+                with self._cr.savepoint():
+                    new_sequences = self._create_sequences_from_template(missing_keys)
+            except IntegrityError as e:
+                if e.pgcode != errorcodes.UNIQUE_VIOLATION:
+                    raise
+                with self._read_committed_env() as env:
+                    template = self.with_env(env)
+                    committed = {key: child_id for key in missing_keys
+                                 for child_id in [template._search_child_sequence_id(company_id, *key)] if child_id}
+                if not committed:
+                    raise
+                sequence_metrics.increment(self._cr.dbname, self.id, sequence_metrics.COUNTER_CONCURRENT_CREATION,
+                                           len(committed))
+                _logger.info("Child sequences %s of sequence template %s created by a concurrent transaction,reused",
+                             list(committed), self.id)
+                concurrent.update(committed)
+                missing_keys = [key for key in missing_keys if key not in committed]
+                continue
+            # counted only once inserted,the attempts rolled back for a concurrent creation are not creations
+            sequence_metrics.increment(self._cr.dbname, self.id, sequence_metrics.COUNTER_CHILD_CREATED,
+                                       len(new_sequences))
+            created.update(zip(missing_keys, new_sequences.ids))
+            for key, child_id in zip(missing_keys, new_sequences.ids):
+                self._cache_child_sequence_id((company_id,) + key, child_id)
+            missing_keys = []
+        return created, concurrent
+
+    def _mark_as_used(self):
+        """ Store today in last_used_date of the sequences after the commit of the transaction,it is done at most once
+        a day by sequence and worker and in its own transaction so the rows of the sequences are not locked by the
+        transactions generating the references"""
+        today = fields.Date.today()
+        dbname = self._cr.dbname
+        sequence_ids = [sequence_id for sequence_id in self.ids if _child_last_use.get((dbname, sequence_id)) != today]
+        if not sequence_ids:
+            return
+        used_ids = self._cr.postcommit.data.get(CHILD_LAST_USE_KEY)
+        if used_ids is None:
+            used_ids = self._cr.postcommit.data[CHILD_LAST_USE_KEY] = set()
+            self._cr.postcommit.add(self.browse()._store_last_use)
+        used_ids.update(sequence_ids)
+
+    @api.model
+    def _store_last_use(self):
+        used_ids = self._cr.postcommit.data.pop(CHILD_LAST_USE_KEY, set())
+        if not used_ids:
+            return
+        today = fields.Date.today()
+        dbname = self._cr.dbname
+        try:
+            with self.pool.cursor() as cr:
+                # the rows locked by a transaction (no gap sequence in use) are skipped,they will be stored later
+                cr.execute("""
+                    WITH locked AS (SELECT id, last_used_date FROM ir_sequence WHERE id IN %s FOR UPDATE SKIP LOCKED),
+                         updated AS (UPDATE ir_sequence SET last_used_date = %s FROM locked
+                                     WHERE ir_sequence.id = locked.id
+                                     AND (locked.last_used_date IS NULL OR locked.last_used_date < %s))
+                    SELECT id FROM locked
+                """, (tuple(used_ids), today, today))
+                stored_ids = [row[0] for row in cr.fetchall()]
+        except OperationalError as e:
+            # the same date is stored by a concurrent worker
+            _logger.debug("Last use of the sequences %s not stored: %s", used_ids, e)
+            return
+        for sequence_id in stored_ids:
+            _child_last_use[(dbname, sequence_id)] = today
+
+    @api.model
+    def _cron_archive_idle_child_sequences(self):
+        """ Archive the child sequences not used since the number of days of the parameter
+        sequence_dynamic.child_idle_days (365 by default,0 to disable),by chunks of 1000 each committed in its own
+        transaction"""
+        idle_days = int(self.env['ir.config_parameter'].sudo().get_param(CHILD_IDLE_DAYS_PARAM, 365))
+        if idle_days <= 0:
+            return
+        limit_date = fields.Date.today() - datetime.timedelta(days=idle_days)
+        children = self.sudo().search([('parent_id', '!=', False), ('idle_archived', '=', False),
+                                       ('last_used_date', '<', limit_date)])
+        archived_count = 0
+        for chunk_ids in tools.split_every(1000, children.ids):
+            # read committed: the date ranges created by the transactions committed before the lock are seen
+            with self.sudo()._read_committed_env() as env:
+                archived_count += len(self.with_env(env).browse(chunk_ids)._archive_idle_sequences(limit_date))
+        _logger.info("%s idle child sequences archived", archived_count)
+
+    def _archive_idle_sequences(self, limit_date):
+        """
+        Archive in bulk the child sequences still not used since limit_date,the child sequences in use by a concurrent
+        transaction are skipped.If one of them is busy the chunk is archived again child sequence by child sequence
+        :return (ir.sequence):the child sequences archived
+        """
+        if not self:
+            return self
+        self.flush()
+        try:
+            with self._cr.savepoint(flush=False):
+                return self._archive_locked_idle_sequences(limit_date)
+        except OperationalError as e:
+            if len(self) == 1:
+                _logger.info("Idle child sequence %s in use,not archived: %s", self.id, e)
+                return self.browse()
+        archived = self.browse()
+        for sequence in self:
+            archived |= sequence._archive_idle_sequences(limit_date)
+        return archived
+
+    def _archive_locked_idle_sequences(self, limit_date):
+        """ Lock the child sequences,their date ranges and their PostgreSQL sequences without waiting then store their
+        next numbers in the column number_next and drop their PostgreSQL sequences,see _revive_idle_sequences.The
+        locks are taken before reading the numbers so no number is given by a concurrent transaction after being read
+        :return (ir.sequence):the child sequences archived
+        """
+        # the row lock blocks the no gap sequences and the creation of date ranges,the last use is checked again
+        self._cr.execute("""
+            SELECT id FROM ir_sequence WHERE id IN %s AND NOT idle_archived AND last_used_date < %s
+            ORDER BY id FOR UPDATE NOWAIT
+        """, (tuple(self.ids), limit_date))
+        sequences = self.browse([row[0] for row in self._cr.fetchall()])
+        if not sequences:
+            return sequences
+        # the values read before the locks (previous attempt on the chunk) may be outdated
+        sequences.invalidate_cache(ids=sequences.ids)
+        self.env['ir.sequence.date_range'].invalidate_cache(['number_next'])
+        date_ranges = sequences.date_range_ids
+        standard_sequences = sequences.filtered(lambda sequence: sequence.implementation == 'standard')
+        standard_ranges = date_ranges.filtered(lambda date_range: date_range.sequence_id.implementation == 'standard')
+        seq_names = ['ir_sequence_%03d' % sequence.id for sequence in standard_sequences]
+        seq_names += ['ir_sequence_%03d_%03d' % (date_range.sequence_id.id, date_range.id)
+                      for date_range in standard_ranges]
+        if seq_names:
+            # nextval keeps a lock on the PostgreSQL sequence until the end of its transaction and ALTER SEQUENCE
+            # conflicts with it (LOCK TABLE doesn't accept sequences),the wait is bounded as NOWAIT would do
+            self._cr.execute("SET LOCAL lock_timeout = '100ms'")
+            self._cr.execute(';'.join('ALTER SEQUENCE %s NO CYCLE' % seq_name for seq_name in seq_names))
+            self._cr.execute("SET LOCAL lock_timeout = DEFAULT")
+        if date_ranges - standard_ranges:
+            self._cr.execute("SELECT id FROM ir_sequence_date_range WHERE id IN %s FOR UPDATE NOWAIT",
+                             [tuple((date_ranges - standard_ranges).ids)])
+        numbers_next = sequences._get_numbers_next()
+        range_numbers_next = {date_range.id: date_range.number_next for date_range in date_ranges}
+        range_numbers_next.update(self._read_pg_sequences(
+            {date_range.id: ('ir_sequence_%03d_%03d' % (date_range.sequence_id.id, date_range.id),
+                             date_range.sequence_id.number_increment) for date_range in standard_ranges}))
+        self._cr.execute("""
+            UPDATE ir_sequence SET number_next = v.number_next, active = false, idle_archived = true,
+                                   write_date = (now() at time zone 'UTC')
+            FROM unnest(%s::integer[], %s::integer[]) AS v(id, number_next)
+            WHERE ir_sequence.id = v.id
+        """, (list(numbers_next), list(numbers_next.values())))
+        if range_numbers_next:
+            self._cr.execute("""
+                UPDATE ir_sequence_date_range SET number_next = v.number_next
+                FROM unnest(%s::integer[], %s::integer[]) AS v(id, number_next)
+                WHERE ir_sequence_date_range.id = v.id
+            """, (list(range_numbers_next), list(range_numbers_next.values())))
+        if seq_names:
+            _drop_sequences(self._cr, seq_names)
+        sequences.invalidate_cache(['number_next', 'active', 'idle_archived', 'write_date'])
+        date_ranges.invalidate_cache(['number_next'])
+        return sequences
+
+    def _revive_idle_sequences(self):
+        """ Restore the child sequences archived by _archive_idle_sequences.The Standard ones are restored in a read
+        committed transaction committed at once: it sees an archive committed after the start of this transaction,a
+        concurrent restoration waits for it instead of failing and the row is not updated by this transaction.The No
+        gap ones are restored in this transaction,their numbers are in their rows"""
+        standard_sequences = self.filtered(lambda sequence: sequence.implementation == 'standard')
+        if standard_sequences:
+            with self._read_committed_env() as env:
+                standard_sequences.with_env(env)._restore_idle_sequences()
+            # the snapshot of this transaction may still show them archived
+            self.env.cache.update(standard_sequences, self._fields['idle_archived'], [False] * len(standard_sequences))
+            self.env.cache.update(standard_sequences, self._fields['active'], [True] * len(standard_sequences))
+        if self - standard_sequences:
+            (self - standard_sequences)._restore_idle_sequences()
+
+    def _restore_idle_sequences(self):
+        """ Create again the PostgreSQL sequences of the child sequences archived as idle from the numbers stored in
+        the column number_next,their last use is today so the next archive doesn't take them again"""
+        self.flush()
+        self._cr.execute("""
+            UPDATE ir_sequence SET active = true, idle_archived = false, last_used_date = CURRENT_DATE,
+                                   write_date = (now() at time zone 'UTC')
+            WHERE id IN %s AND idle_archived
+            RETURNING id, number_next, number_increment, implementation
+        """, [tuple(self.ids)])
+        standard_ids = []
+        for sequence_id, number_next, number_increment, implementation in self._cr.fetchall():
+            if implementation == 'standard':
+                standard_ids.append(sequence_id)
+                _create_sequence(self._cr, 'ir_sequence_%03d' % sequence_id, number_increment, number_next)
+        if standard_ids:
+            self._cr.execute("""
+                SELECT date_range.id, date_range.sequence_id, date_range.number_next, sequence.number_increment
+                FROM ir_sequence_date_range date_range JOIN ir_sequence sequence ON sequence.id = date_range.sequence_id
+                WHERE date_range.sequence_id IN %s
+            """, [tuple(standard_ids)])
+            for date_range_id, sequence_id, number_next, number_increment in self._cr.fetchall():
+                _create_sequence(self._cr, 'ir_sequence_%03d_%03d' % (sequence_id, date_range_id), number_increment,
+                                 number_next)
+        _logger.info("Idle child sequences %s restored", self.ids)
+        self.invalidate_cache(['active', 'idle_archived', 'last_used_date', 'write_date'])
+        self.date_range_ids.invalidate_cache(['number_next_actual'])
 
     def _create_sequence_from_template(self, prefix=False, generator_code=False):
-        new_sequence = self.sudo().copy({'prefix': prefix,
-                                  'generator_code': generator_code,
-                                  'parent_id': self.id,
-                                  'sequence_type': 'sequence',
-                                  'number_next': 1,
-                                  'related_model': False,
-                                  'dynamic_prefix_code': False,
-                                  })
-        # we have to copy the date range if the template have that
-        if self.use_date_range and self.date_range_ids:
-            for date_range in self.date_range_ids:
-                new_date_range = date_range.copy({
-                    'sequence_id': new_sequence.id,
-                    'number_next_actual': date_range.number_next_actual
-                })
-        return new_sequence
-
-    def _build_code(self, code_type,fields_check_strict=True):
+        return self._create_sequences_from_template([(prefix, generator_code)])
+
+    @instrumented('create_sequence_from_template')
+    def _create_sequences_from_template(self, keys):
+        """ Create in one call the child sequences of the template for each (prefix, generator_code) of keys"""
+        template = self.sudo()
+        vals_list = [template.copy_data({'prefix': prefix,
+                                         'generator_code': generator_code,
+                                         'parent_id': self.id,
+                                         'sequence_type': 'sequence',
+                                         'number_next': 1,
+                                         'last_used_date': fields.Date.today(),
+                                         'related_model': False,
+                                         'dynamic_prefix_code': False,
+                                         })[0] for prefix, generator_code in keys]
+        # the date ranges of the template are copied only when a number is requested in them,see _create_date_range_seq
+        return template.create(vals_list)
+
+    @instrumented('build_code')
+    def _build_code(self, code_type,fields_check_strict=True, dynamic_prefix_fields=None, eval_context=None):
         """
         This method is used to generate code instance relying on the fields of the model
         :param code_type (char):used to determine the type of the code dynamic_suffix_code,dynamic_prefix_code...,the behaviour
         of the method will change depending on the behaviour of this parameter
         :param fields_check_strict (bool):if this parameter is True,this method will return False if any of the fields
         is null,otherwise it will return the found code and let the check responsability to the caller method
+        :param dynamic_prefix_fields (dict):the values of the dynamic fields,taken from the context if not specified
+        :param eval_context (DynamicCodeContext):used instead of dynamic_prefix_fields to share the resolved values
+        between the codes of the same reference
         """
-        dynamic_prefix_fields = self.env.context.get('dynamic_prefix_fields', False)
+        if eval_context is None:
+            eval_context = self._get_dynamic_code_context(dynamic_prefix_fields)
+        if not eval_context.related_model:
+            raise UserError(_("No related model detected,can not build dynamic sequence!"))
+        if not eval_context.dynamic_prefix_fields:
+            raise UserError(_("No dynamic prefix fields has been found!"))
+        plan = self._get_code_plan(code_type, eval_context.related_model)
+        return self._render_code_plan(plan, eval_context, fields_check_strict=fields_check_strict)
+
+    def _get_dynamic_code_context(self, dynamic_prefix_fields=None):
+        """ Return the DynamicCodeContext used to evaluate the codes of this sequence for one reference,the checks of
+        the related model and of the dynamic fields are done by _build_code when a code is really evaluated"""
+        if dynamic_prefix_fields is None:
+            dynamic_prefix_fields = self.env.context.get('dynamic_prefix_fields', False)
         # the model using he sequence,here we hve to get this model in the logic order,we get the model imposed in the context
         # and if it is not specified we get the model specified in the sequence template to control the dynamic fields because
         # this settings is considered as explicit specification of the model,and if this is not specified as well,we suppose that th model
@@ -260,15 +1477,32 @@ class IrSequence(models.Model):
             try:
                 related_model = self.env[self.code]._name
             except KeyError:
-                raise UserError(_("No related model detected,can not build dynamic sequence!"))
-        if not dynamic_prefix_fields:
-            raise UserError(_("No dynamic prefix fields has been found!"))
+                related_model = False
+        return DynamicCodeContext(related_model, dynamic_prefix_fields)
+
+    def _get_code_plan(self, code_type, related_model):
+        """ Return the compiled plan of the code stored in the field code_type of the sequence template,the plan is
+        cached by (sequence,write_date) so the parsing is done only once for each version of the template"""
+        self.ensure_one()
+        return self._compile_code_plan(self.id, self.write_date, code_type, related_model)
+
+    @api.model
+    @tools.ormcache('sequence_id', 'write_date', 'code_type', 'related_model')
+    def _compile_code_plan(self, sequence_id, write_date, code_type, related_model):
+        """
+        Parse the code of the sequence into an immutable tuple of CodeToken
+        :param sequence_id (int):the id of the sequence template
+        :param write_date (datetime):the last modification date of the sequence,only used as part of the cache key
+        :param code_type (char):the field containing the code dynamic_suffix_code,dynamic_prefix_code...
+        :param related_model (char):the model on which the fields of the code will be resolved
+        """
+        code = getattr(self.browse(sequence_id), code_type)
         record = self.env[related_model]
-        fields = self._parse_fields(getattr(self, code_type))
-        prefix = ''
-        for field in fields:
-            if field in self._parse_static_fields(getattr(self, code_type)):
-                prefix += self._parse_static_field(field)
+        static_fields = set(self._parse_static_fields(code))
+        plan = []
+        for field in self._parse_fields(code):
+            if field in static_fields:
+                plan.append(CodeToken(self._parse_static_field(field), False, False, 0, False))
                 continue
             try:
                 # we have to parse the padding from the field codification
@@ -277,40 +1511,41 @@ class IrSequence(models.Model):
                 field_obj = record._fields[field.split(".")[0]]
             except KeyError as ae:
                 raise UserError(_('No field %s detected in model %s') % (field, record._name))
-            else:
-                if code_type in (TYPE_DYNAMIC_PREF_CODE,) and field_obj.type not in ('char', 'many2one'):
-                    raise UserError(
-                        _('field used in dynamic prefix must be char or many2one,the type of field %s is %s') % (
-                            field_obj.string, field_obj.type))
-                if field_obj.type == 'char':
-                    val = dynamic_prefix_fields[field_obj.name]
-                    if not val:
-                        if fields_check_strict:
-                            return False
-                        else:
-                            val = ''
-                    prefix += val
-                elif field_obj.type not in ('many2one', 'one2many', 'many2many'):
-                    val = dynamic_prefix_fields[field_obj.name]
-                    if not val:
-                        if fields_check_strict:
-                            return False
-                        else:
-                            val = ''
-                    if not padding or val == '':
-                        prefix += str(val)
-                    else:
-                        prefix += '%%0%sd' % padding % val
-                elif field_obj.type == 'many2one':
-                    val = self._parse_many2one_field(record, dynamic_prefix_fields, field)
-                    if not val:
-                        if fields_check_strict:
-                            return False
-                        else:
-                            val = ''
-                    prefix += val
+            if code_type in (TYPE_DYNAMIC_PREF_CODE,) and field_obj.type not in ('char', 'many2one'):
+                raise UserError(
+                    _('field used in dynamic prefix must be char or many2one,the type of field %s is %s') % (
+                        field_obj.string, field_obj.type))
+            if field_obj.type in ('one2many', 'many2many'):
+                raise ValidationError(_("The field %s type is not authorised!") % field_obj.string)
+            plan.append(CodeToken(False, field_obj.name, field, padding, field_obj.type))
+        return tuple(plan)
+
+    @api.model
+    def _render_code_plan(self, plan, eval_context, fields_check_strict=True):
+        """ Substitute the values of the dynamic fields in the compiled plan,see _build_code for the parameters"""
+        prefix = ''
+        for token in plan:
+            if not token.field_name:
+                prefix += token.static_value
+                continue
+            if token.path not in eval_context.values:
+                if token.field_type == 'many2one':
+                    eval_context.values[token.path] = self._parse_many2one_field(
+                        self.env[eval_context.related_model], eval_context.dynamic_prefix_fields, token.path,
+                        records=eval_context.records)
                 else:
-                    raise ValidationError(_("The field %s type is not authorised!") % field_obj.description)
+                    eval_context.values[token.path] = eval_context.dynamic_prefix_fields[token.field_name]
+            val = eval_context.values[token.path]
+            if not val:
+                if fields_check_strict:
+                    return False
+                val = ''
+            if token.field_type in ('char', 'many2one'):
+                prefix += val
+            elif not token.padding or val == '':
+                prefix += str(val)
+            else:
+                prefix += '%%0%sd' % token.padding % val
         return prefix
 
     @api.model
@@ -336,12 +1571,39 @@ class IrSequence(models.Model):
     def _remove_static_fields(self):
         pass
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(IrSequence, self).create(vals_list)
+        # the child sequences created by the templates don't change the cached lookups,see _get_child_sequence_id
+        if any(not vals.get('parent_id') for vals in vals_list):
+            self.clear_caches()
+        return res
+
+    def write(self, vals):
+        res = super(IrSequence, self).write(vals)
+        if not CACHE_INVALIDATION_FIELDS.isdisjoint(vals):
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super(IrSequence, self).unlink()
+        self.clear_caches()
+        return res
+
     @api.model
-    def _parse_many2one_field(self, record, dynamic_prefix_fields, field):
+    def _parse_many2one_field(self, record, dynamic_prefix_fields, field, records=None):
+        """ Return the concatenation of the values of the many2one chain field,records is an optional dict used to
+        share the record of the first field of the chain between the calls"""
         prefix = ''
         nested_list_fields = field.split(".")
         next_field = nested_list_fields.pop(0)
-        record = self._get_record_from_field_value(record, dynamic_prefix_fields, next_field)
+        if records is None:
+            record = self._get_record_from_field_value(record, dynamic_prefix_fields, next_field)
+        else:
+            if next_field not in records:
+                # the other fields of the chain are read by the prefetching of the ORM in one query by model
+                records[next_field] = self._get_record_from_field_value(record, dynamic_prefix_fields, next_field)
+            record = records[next_field]
         if not record:
             return False
         while nested_list_fields:
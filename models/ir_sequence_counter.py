@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import fields, models, api
+
+
+class IrSequenceCounter(models.Model):
+    """ Counter of a sequence template using the storage mode Counters,it replaces the child sequence (and its date
+    ranges and PostgreSQL sequences) that would have been created for each prefix/generator code"""
+    _name = 'ir.sequence.counter'
+    _description = 'Sequence template counter'
+    _order = 'sequence_id,generator_code,prefix,date_from'
+    # the counters are only modified by _reserve_numbers,the access log columns are not needed
+    _log_access = False
+
+    sequence_id = fields.Many2one('ir.sequence', string='Sequence template', required=True, readonly=True,
+                                  ondelete='cascade')
+    company_id = fields.Many2one('res.company', string='Company', readonly=True)
+    prefix = fields.Char(string='Prefix', readonly=True)
+    generator_code = fields.Char(string='Generator code', readonly=True)
+    date_from = fields.Date(string='From', readonly=True)
+    date_to = fields.Date(string='To', readonly=True)
+    number_next = fields.Integer(string='Next Number', required=True, default=1)
+
+    def init(self):
+        # the columns that can be null are coalesced so the index can be used as arbiter of ON CONFLICT
+        self._cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ir_sequence_counter_key_uniq ON ir_sequence_counter
+            (sequence_id, COALESCE(company_id, 0), COALESCE(prefix, ''), COALESCE(generator_code, ''),
+             COALESCE(date_from, '0001-01-01'))
+        """)
+
+    @api.model
+    def _reserve_numbers(self, sequence, prefix, generator_code, date_from, date_to, number_next, count=1):
+        """
+        Reserve count consecutive numbers of the counter of the template in one statement,the counter is created if
+        it doesn't exist yet
+        :param sequence (ir.sequence):the sequence template
+        :param number_next (int):the first number of the counter if it must be created
+        :return (list):the reserved numbers
+        """
+        increment = sequence.number_increment * count
+        self._cr.execute("""
+            INSERT INTO ir_sequence_counter AS counter
+                (sequence_id, company_id, prefix, generator_code, date_from, date_to, number_next)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (sequence_id, COALESCE(company_id, 0), COALESCE(prefix, ''), COALESCE(generator_code, ''),
+                         COALESCE(date_from, '0001-01-01'))
+            DO UPDATE SET number_next = counter.number_next + %s
+            RETURNING number_next
+        """, (sequence.id, sequence.company_id.id or None, prefix or None, generator_code or None, date_from or None,
+              date_to or None, number_next + increment, increment))
+        first_number = self._cr.fetchone()[0] - increment
+        self.invalidate_cache(['number_next'])
+        return [first_number + index * sequence.number_increment for index in range(count)]
+
+    @api.model
+    def _advance_counters(self, sequence, numbers_next):
+        """
+        Create the missing counters of the template and advance the existing ones to the numbers of numbers_next in
+        one statement,the numbers are never decreased
+        :param sequence (ir.sequence):the sequence template
+        :param numbers_next (dict):(prefix, generator_code): the minimal next number of the counter
+        :return (list):see _backfill_child_sequences of ir.sequence
+        """
+        if not numbers_next:
+            return []
+        company_id = sequence.company_id.id or None
+        self._cr.execute("""
+            SELECT prefix, generator_code, number_next FROM ir_sequence_counter
+            WHERE sequence_id = %s AND COALESCE(company_id, 0) = %s AND date_from IS NULL
+        """, (sequence.id, company_id or 0))
+        numbers_before = {(prefix or False, generator_code or False): number_next
+                          for prefix, generator_code, number_next in self._cr.fetchall()}
+        keys = list(numbers_next)
+        self._cr.execute("""
+            INSERT INTO ir_sequence_counter AS counter (sequence_id, company_id, prefix, generator_code, number_next)
+            SELECT %s, %s, v.prefix, v.generator_code, v.number_next
+            FROM unnest(%s::varchar[], %s::varchar[], %s::integer[]) AS v(prefix, generator_code, number_next)
+            ON CONFLICT (sequence_id, COALESCE(company_id, 0), COALESCE(prefix, ''), COALESCE(generator_code, ''),
+                         COALESCE(date_from, '0001-01-01'))
+            DO UPDATE SET number_next = GREATEST(counter.number_next, EXCLUDED.number_next)
+        """, (sequence.id, company_id, [key[0] or None for key in keys], [key[1] or None for key in keys],
+              [numbers_next[key] for key in keys]))
+        self.invalidate_cache(['number_next'])
+        report = []
+        for key in keys:
+            number_before = numbers_before.get(key, False)
+            report.append({
+                'prefix': key[0],
+                'generator_code': key[1],
+                'max_number': numbers_next[key] - sequence.number_increment,
+                'number_next_before': number_before,
+                'number_next': max(number_before or 0, numbers_next[key]),
+                'action': number_before is False and 'created' or number_before < numbers_next[key] and 'advanced'
+                or 'unchanged',
+            })
+        return report
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import models
+
+
+# Fields of a date range whose modification must discard the blocks of numbers reserved by the workers
+NUMBER_BLOCKS_FIELDS = {'date_from', 'date_to', 'number_next', 'number_next_actual'}
+
+
+class IrSequenceDateRange(models.Model):
+    _inherit = 'ir.sequence.date_range'
+
+    def _get_number_next_actual(self):
+        """ Inherit this method to give the number stored in number_next for the date ranges of the child sequences
+        archived as idle,their PostgreSQL sequences have been dropped"""
+        archived = self.filtered(lambda date_range: date_range.sequence_id.idle_archived)
+        for date_range in archived:
+            date_range.number_next_actual = date_range.number_next
+        super(IrSequenceDateRange, self - archived)._get_number_next_actual()
+
+    def write(self, vals):
+        res = super(IrSequenceDateRange, self).write(vals)
+        if not NUMBER_BLOCKS_FIELDS.isdisjoint(vals):
+            self.sequence_id._discard_number_blocks()
+        return res
+
+    def unlink(self):
+        sequences = self.sequence_id
+        res = super(IrSequenceDateRange, self).unlink()
+        sequences._discard_number_blocks()
+        return res
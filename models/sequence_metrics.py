@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+"""
+Optional instrumentation of the dynamic sequences.
+
+The metrics are collected in memory by each worker only if the option sequence_dynamic_metrics is set in the server
+configuration file,when it is not set the instrumented methods only pay a dictionary lookup.
+"""
+import functools
+import threading
+import time
+
+from odoo.tools import config, str2bool
+from psycopg2 import errorcodes, IntegrityError, OperationalError
+
+METRICS_OPTION = 'sequence_dynamic_metrics'
+
+# upper bounds (in milliseconds) of the buckets of the latency histograms,the last bucket has no upper bound
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+COUNTER_CHILD_CREATED = 'child_created'
+COUNTER_DEFAULT_FALLBACK = 'default_sequence_fallback'
+COUNTER_CONCURRENT_CREATION = 'concurrent_child_creation'
+COUNTER_LOCK_ERROR = 'lock_error'
+COUNTER_CONSTRAINT_ERROR = 'constraint_error'
+
+LOCK_ERROR_CODES = (errorcodes.LOCK_NOT_AVAILABLE, errorcodes.SERIALIZATION_FAILURE, errorcodes.DEADLOCK_DETECTED)
+
+# dbname: key (id of the template or sequence code): {'phases': {phase: stats}, 'counters': {counter: value}}
+_metrics = {}
+_metrics_lock = threading.Lock()
+# depth of the instrumented calls of the current thread,the errors are counted only by the outermost call
+_instrumentation = threading.local()
+
+
+def metrics_enabled():
+    return str2bool(config.get(METRICS_OPTION) or False, default=False)
+
+
+def _get_entry(dbname, key):
+    return _metrics.setdefault(dbname, {}).setdefault(key, {'phases': {}, 'counters': {}})
+
+
+def record_latency(dbname, key, phase, duration, error=False):
+    """ Record one call of phase that took duration seconds"""
+    duration_ms = duration * 1000
+    bucket = next((index for index, bound in enumerate(LATENCY_BUCKETS) if duration_ms <= bound),
+                  len(LATENCY_BUCKETS))
+    with _metrics_lock:
+        stats = _get_entry(dbname, key)['phases'].setdefault(phase, {
+            'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'histogram': [0] * (len(LATENCY_BUCKETS) + 1)})
+        stats['count'] += 1
+        stats['errors'] += int(error)
+        stats['total_ms'] += duration_ms
+        stats['max_ms'] = max(stats['max_ms'], duration_ms)
+        stats['histogram'][bucket] += 1
+
+
+def increment(dbname, key, counter, value=1):
+    if not metrics_enabled():
+        return
+    with _metrics_lock:
+        counters = _get_entry(dbname, key)['counters']
+        counters[counter] = counters.get(counter, 0) + value
+
+
+def _histogram_percentile(histogram, rank):
+    """ Return the upper bound (ms) of the bucket containing the percentile rank,False for the last bucket"""
+    threshold = sum(histogram) * rank / 100.0
+    cumulated = 0
+    for index, count in enumerate(histogram):
+        cumulated += count
+        if count and cumulated >= threshold:
+            return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else False
+    return False
+
+
+def get_metrics(dbname, keys=None):
+    """ Return a copy of the metrics of the database (only those of keys if specified) with the percentiles"""
+    with _metrics_lock:
+        entries = _metrics.get(dbname, {})
+        result = {}
+        for key, entry in entries.items():
+            if keys is not None and key not in keys:
+                continue
+            phases = {}
+            for phase, stats in entry['phases'].items():
+                phases[phase] = dict(stats, histogram=list(stats['histogram']),
+                                     avg_ms=stats['count'] and stats['total_ms'] / stats['count'],
+                                     p50_ms=_histogram_percentile(stats['histogram'], 50),
+                                     p99_ms=_histogram_percentile(stats['histogram'], 99))
+            result[key] = {'phases': phases, 'counters': dict(entry['counters'])}
+    return result
+
+
+def format_metrics(entry):
+    """ Return a readable summary of the metrics of one key as returned by get_metrics"""
+    lines = []
+    for phase, stats in sorted(entry['phases'].items()):
+        lines.append('%s: %s calls,%s errors,avg %.3f ms,p50 %s,p99 %s,max %.3f ms' % (
+            phase, stats['count'], stats['errors'], stats['avg_ms'],
+            _format_bound(stats['p50_ms']), _format_bound(stats['p99_ms']), stats['max_ms']))
+    for counter, value in sorted(entry['counters'].items()):
+        lines.append('%s: %s' % (counter, value))
+    return '\n'.join(lines)
+
+
+def _format_bound(bound):
+    return '<= %s ms' % bound if bound else '> %s ms' % LATENCY_BUCKETS[-1]
+
+
+def reset_metrics(dbname):
+    with _metrics_lock:
+        _metrics.pop(dbname, None)
+
+
+def instrumented(phase, key=None):
+    """
+    Decorator recording the latency of the method in phase when the instrumentation is enabled
+    :param key (function):called with the arguments of the method to get the key of the metrics,by default the id
+    of the sequence
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not metrics_enabled():
+                return method(self, *args, **kwargs)
+            metrics_key = key(self, *args, **kwargs) if key else (self.id if len(self) == 1 else False)
+            dbname = self._cr.dbname
+            depth = getattr(_instrumentation, 'depth', 0)
+            _instrumentation.depth = depth + 1
+            start = time.perf_counter()
+            error = False
+            try:
+                return method(self, *args, **kwargs)
+            except IntegrityError:
+                error = True
+                if not depth:
+                    increment(dbname, metrics_key, COUNTER_CONSTRAINT_ERROR)
+                raise
+            except OperationalError as e:
+                error = True
+                if not depth and e.pgcode in LOCK_ERROR_CODES:
+                    increment(dbname, metrics_key, COUNTER_LOCK_ERROR)
+                raise
+            except Exception:
+                error = True
+                raise
+            finally:
+                _instrumentation.depth = depth
+                record_latency(dbname, metrics_key, phase, time.perf_counter() - start, error=error)
+        return wrapper
+    return decorator
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+from . import test_sequence_dynamic
+from . import test_sequence_dynamic_concurrency
\ No newline at end of file
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+import uuid
+
+from odoo import fields
+from odoo.exceptions import ValidationError
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+
+@tagged('post_install', '-at_install')
+class TestSequenceDynamicBatch(TransactionCase):
+
+    def setUp(self):
+        super(TestSequenceDynamicBatch, self).setUp()
+        self.refs = [uuid.uuid4().hex, uuid.uuid4().hex]
+
+    def _create_template(self, **vals):
+        code = 'test_sequence_dynamic.batch.%s' % uuid.uuid4().hex
+        self.env['ir.sequence'].create(dict({
+            'name': 'Batch test',
+            'code': code,
+            'sequence_type': 'sequence_template',
+            'related_model': self.env['ir.model']._get('res.partner').id,
+            'sequence_generator_code': '%(ref)',
+            'padding': 4,
+        }, **vals))
+        return code
+
+    def assertBatchEqualsSequential(self, code, dynamic_prefix_fields_list):
+        """ Generate the references one by one then,after rolling back the child sequences created,in one batch"""
+        sequence = self.env['ir.sequence']
+        self.env['base'].flush()
+        self.cr.execute('SAVEPOINT test_sequence_dynamic_batch')
+        sequential = [sequence.with_context(dynamic_prefix_fields=dynamic_prefix_fields).next_by_code(code)
+                      for dynamic_prefix_fields in dynamic_prefix_fields_list]
+        self.cr.execute('ROLLBACK TO SAVEPOINT test_sequence_dynamic_batch')
+        self.env.clear()
+        batch = sequence.next_by_code_batch(code, dynamic_prefix_fields_list)
+        self.assertEqual(batch, sequential)
+        return batch
+
+    def _get_fields_list(self):
+        return [{'ref': self.refs[index]} for index in (0, 1, 0, 0, 1, 0, 0)]
+
+    def _get_template(self, code):
+        return self.env['ir.sequence'].search([('code', '=', code)])
+
+    def _next_references(self, code, dates):
+        """ Generate the references of _get_fields_list one by one for each date"""
+        sequence = self.env['ir.sequence']
+        return [sequence.with_context(ir_sequence_date=date, dynamic_prefix_fields=dynamic_prefix_fields).next_by_code(code)
+                for date in dates for dynamic_prefix_fields in self._get_fields_list()]
+
+    def test_batch_standard(self):
+        code = self._create_template(implementation='standard')
+        references = self.assertBatchEqualsSequential(code, self._get_fields_list())
+        self.assertEqual(references, ['0001', '0001', '0002', '0003', '0002', '0004', '0005'])
+
+    def test_batch_no_gap(self):
+        code = self._create_template(implementation='no_gap')
+        self.assertBatchEqualsSequential(code, self._get_fields_list())
+
+    def test_batch_number_blocks(self):
+        """ The batch takes its numbers from the blocks reserved by the worker as next_by_code"""
+        code = self._create_template(implementation='standard', number_block_size=3)
+        self.assertBatchEqualsSequential(code, self._get_fields_list())
+
+    def test_batch_dynamic_prefix_and_suffix(self):
+        code = self._create_template(implementation='standard', dynamic_prefix_code='%(**INV-,ref,**-)',
+                                     dynamic_suffix_code='%(**/,ref)')
+        references = self.assertBatchEqualsSequential(code, self._get_fields_list())
+        self.assertEqual(references[0], 'INV-%s-0001/%s' % (self.refs[0], self.refs[0]))
+
+    def test_child_yearly_date_range_bounded_by_template(self):
+        """ The yearly date range of a child sequence stops before the date ranges of its template"""
+        code = self._create_template(implementation='standard', use_date_range=True, date_range_ids=[
+            (0, 0, {'date_from': '2026-07-01', 'date_to': '2026-12-31'})])
+        sequence = self.env['ir.sequence'].with_context(dynamic_prefix_fields={'ref': self.refs[0]})
+        sequence.with_context(ir_sequence_date='2026-03-15').next_by_code(code)
+        sequence.with_context(ir_sequence_date='2026-08-01').next_by_code(code)
+        child = self.env['ir.sequence'].search([('parent_id.code', '=', code)])
+        self.assertEqual([(str(date_range.date_from), str(date_range.date_to))
+                          for date_range in child.date_range_ids.sorted('date_from')],
+                         [('2026-01-01', '2026-06-30'), ('2026-07-01', '2026-12-31')])
+
+    def test_number_blocks_date_range_modified(self):
+        """ The blocks reserved by the worker are discarded when the next number of their date range is modified"""
+        sequence = self.env['ir.sequence'].create({
+            'name': 'Blocks test',
+            'implementation': 'standard',
+            'number_block_size': 5,
+            'use_date_range': True,
+            'padding': 4,
+        }).with_context(ir_sequence_date='2026-03-15')
+        self.assertEqual(sequence.next_by_id(), '0001')
+        sequence.date_range_ids.number_next_actual = 20
+        self.assertEqual(sequence.next_by_id(), '0020')
+
+    def test_counter_same_references(self):
+        """ The counters give the references the child sequences would give,with and without date ranges"""
+        dates = ['2026-03-15', '2026-08-01', '2026-03-20']
+        for vals in ({}, {'use_date_range': True, 'suffix': '/%(range_year)s', 'date_range_ids': [
+                (0, 0, {'date_from': '2026-07-01', 'date_to': '2026-12-31', 'number_next': 10})]}):
+            with self.subTest(use_date_range=bool(vals)):
+                references = self._next_references(self._create_template(implementation='standard', **vals), dates)
+                counter_references = self._next_references(self._create_template(storage_mode='counter', **vals), dates)
+                self.assertEqual(counter_references, references)
+
+    def test_storage_mode_switch_rejected(self):
+        """ The storage mode of a template can be changed only before its first reference"""
+        sequence = self.env['ir.sequence'].with_context(dynamic_prefix_fields={'ref': self.refs[0]})
+        template = self._get_template(self._create_template(implementation='standard'))
+        template.storage_mode = 'counter'
+        template.storage_mode = 'sequence'
+        sequence.next_by_code(template.code)
+        with self.assertRaises(ValidationError):
+            template.storage_mode = 'counter'
+        template = self._get_template(self._create_template(storage_mode='counter'))
+        sequence.next_by_code(template.code)
+        with self.assertRaises(ValidationError):
+            template.storage_mode = 'sequence'
+
+    def test_backfill_numeric_suffixes(self):
+        """ The digits of the suffix and of the dynamic suffix following the number are not taken as part of it"""
+        city = uuid.uuid4().hex[:12]
+        code = self._create_template(implementation='standard', dynamic_prefix_code='%(city,**-)',
+                                     sequence_generator_code=False, suffix='%(year)s', dynamic_suffix_code='%(zip)')
+        year = str(fields.Date.today().year)
+        self.env['res.partner'].create([{'name': 'Backfill', 'city': city, 'zip': '75001',
+                                         'ref': '%s-%04d%s75001' % (city, number, year)} for number in (3, 12, 7)])
+        report = self._get_template(code)._backfill_child_sequences('ref')
+        self.assertEqual([(line['prefix'], line['max_number'], line['action']) for line in report],
+                         [('%s-' % city, 12, 'created')])
+        reference = self.env['ir.sequence'].with_context(
+            dynamic_prefix_fields={'city': city, 'zip': '75001'}).next_by_code(code)
+        self.assertEqual(reference, '%s-0013%s75001' % (city, year))
+
+    def test_backfill_with_gaps(self):
+        """ The child sequences (or counters) continue after the greatest number used,whatever the gaps"""
+        for storage_mode in ('sequence', 'counter'):
+            with self.subTest(storage_mode=storage_mode):
+                cities = [uuid.uuid4().hex[:12], uuid.uuid4().hex[:12]]
+                code = self._create_template(storage_mode=storage_mode, dynamic_prefix_code='%(city,**/)',
+                                             sequence_generator_code=False)
+                template = self._get_template(code)
+                sequence = self.env['ir.sequence']
+                # the child sequence of the first city exists already,the one of the second doesn't
+                self.assertEqual(sequence.with_context(dynamic_prefix_fields={'city': cities[0]}).next_by_code(code),
+                                 '%s/0001' % cities[0])
+                self.env['res.partner'].create([
+                    {'name': 'Backfill', 'city': city, 'ref': '%s/%04d' % (city, number)}
+                    for city, number in ((cities[0], 2), (cities[0], 9), (cities[0], 5), (cities[1], 4))])
+                report = template._backfill_child_sequences('ref')
+                self.assertEqual(sorted((line['prefix'], line['number_next'], line['action']) for line in report),
+                                 sorted([('%s/' % cities[0], 10, 'advanced'), ('%s/' % cities[1], 5, 'created')]))
+                for city, reference in zip(cities, ('0010', '0005')):
+                    self.assertEqual(sequence.with_context(dynamic_prefix_fields={'city': city}).next_by_code(code),
+                                     '%s/%s' % (city, reference))
+                report = template._backfill_child_sequences('ref')
+                self.assertEqual({line['action'] for line in report}, {'unchanged'})
+
+    def test_deferred_numbering_precommit(self):
+        """ The provisional references of this transaction still used by a record,archived or not,are replaced at the
+        commit in the order they have been given,without taking a number for the others"""
+        code = self._create_template(implementation='no_gap', deferred_numbering=True)
+        sequence = self.env['ir.sequence'].with_context(dynamic_prefix_fields={'ref': self.refs[0]})
+        provisionals = [sequence.next_by_code(code) for index in range(4)]
+        # the records are created in the reverse order of their provisional references
+        partners = self.env['res.partner'].create([{'name': name} for name in reversed(provisionals)])[::-1]
+        partners[1].name = 'Renamed'
+        partners[3].active = False
+        # a provisional reference given by another transaction
+        other = self.env['res.partner'].create({'name': 'TMP/%s' % uuid.uuid4().hex})
+        self.env.cr.precommit.run()
+        self.assertEqual(partners.mapped('name'), ['0001', 'Renamed', '0002', '0003'])
+        self.assertTrue(other.name.startswith('TMP/'))
+
+    def test_deferred_numbering_rollback(self):
+        """ The numbers assigned in a transaction rolled back are assigned again,the No gap child sequence keeps no
+        gap"""
+        code = self._create_template(implementation='no_gap', deferred_numbering=True)
+        sequence = self.env['ir.sequence'].with_context(dynamic_prefix_fields={'ref': self.refs[0]})
+        self.env['base'].flush()
+        self.cr.execute('SAVEPOINT test_deferred_numbering')
+        partner = self.env['res.partner'].create({'name': sequence.next_by_code(code)})
+        self.env.cr.precommit.run()
+        self.assertEqual(partner.name, '0001')
+        self.cr.execute('ROLLBACK TO SAVEPOINT test_deferred_numbering')
+        self.env.clear()
+        partner = self.env['res.partner'].create({'name': sequence.next_by_code(code)})
+        self.env.cr.precommit.run()
+        self.assertEqual(partner.name, '0001')
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+import datetime
+import threading
+import uuid
+from contextlib import contextmanager
+
+from psycopg2.errors import SerializationFailure
+
+import odoo
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import common, tagged
+
+THREADS = 8
+
+
+@contextmanager
+def environment():
+    """ Return an environment with a new cursor for the current database,the cursor is committed and closed after the
+    context block"""
+    registry = odoo.registry(common.get_db_name())
+    with registry.cursor() as cr:
+        yield odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+
+
+@tagged('post_install', '-at_install')
+class TestSequenceDynamicConcurrency(common.BaseCase):
+    """ The child sequences are created by committed transactions,these tests can not run in the transaction of a
+    TransactionCase"""
+
+    def setUp(self):
+        super(TestSequenceDynamicConcurrency, self).setUp()
+        self.code = 'test_sequence_dynamic.concurrency.%s' % uuid.uuid4().hex
+        with environment() as env:
+            self.template_id = env['ir.sequence'].create({
+                'name': 'Concurrency test',
+                'code': self.code,
+                'sequence_type': 'sequence_template',
+                'related_model': env['ir.model']._get('res.partner').id,
+                'sequence_generator_code': '%(ref)',
+                'implementation': 'standard',
+                'padding': 5,
+            }).id
+
+    def tearDown(self):
+        with environment() as env:
+            env['ir.sequence'].with_context(active_test=False).search(
+                [('parent_id', '=', self.template_id)]).unlink()
+            env['ir.sequence'].browse(self.template_id).unlink()
+        super(TestSequenceDynamicConcurrency, self).tearDown()
+
+    def _next_by_code(self, env, ref):
+        return env['ir.sequence'].with_context(dynamic_prefix_fields={'ref': ref}).next_by_code(self.code)
+
+    def _get_children(self, env):
+        return env['ir.sequence'].with_context(active_test=False).search([('parent_id', '=', self.template_id)])
+
+    def test_child_committed_after_snapshot(self):
+        """ The child sequence committed by a concurrent transaction after the start of this one is reused"""
+        ref = uuid.uuid4().hex
+        with environment() as env2:
+            # the snapshot of the second transaction is taken before the creation of the child sequence
+            env2.cr.execute("SELECT 1")
+            with environment() as env1:
+                reference1 = self._next_by_code(env1, ref)
+            reference2 = self._next_by_code(env2, ref)
+        self.assertEqual(reference1, '00001')
+        self.assertEqual(reference2, '00002')
+        with environment() as env:
+            self.assertEqual(len(self._get_children(env)), 1)
+
+    def test_no_gap_child_committed_after_snapshot(self):
+        """ The No gap child sequence committed by a concurrent transaction after the start of this one is refused,its
+        numbers would be lost if this transaction was rolled back"""
+        with environment() as env:
+            env['ir.sequence'].browse(self.template_id).implementation = 'no_gap'
+        ref = uuid.uuid4().hex
+        with self.assertRaises(UserError):
+            with environment() as env2:
+                env2.cr.execute("SELECT 1")
+                with environment() as env1:
+                    self.assertEqual(self._next_by_code(env1, ref), '00001')
+                self._next_by_code(env2, ref)
+        with environment() as env:
+            self.assertEqual(self._next_by_code(env, ref), '00002')
+
+    def test_child_created_in_parallel(self):
+        """ The transaction waiting for the creation of the same child sequence by another one reuses it"""
+        ref = uuid.uuid4().hex
+        result = {}
+
+        def second_transaction():
+            try:
+                with environment() as env2:
+                    result['reference'] = self._next_by_code(env2, ref)
+            except Exception as e:
+                result['error'] = e
+
+        with environment() as env1:
+            reference1 = self._next_by_code(env1, ref)
+            thread = threading.Thread(target=second_transaction)
+            thread.start()
+            # the second transaction waits for the commit of the first one in the insertion of the child sequence
+            thread.join(1)
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        self.assertNotIn('error', result)
+        self.assertEqual(reference1, '00001')
+        self.assertEqual(result['reference'], '00002')
+        with environment() as env:
+            self.assertEqual(len(self._get_children(env)), 1)
+
+    def test_many_transactions_in_parallel(self):
+        """ Many transactions creating and using the same and different child sequences at the same time give unique
+        references without serialization failure"""
+        shared_refs = [uuid.uuid4().hex, uuid.uuid4().hex]
+        own_refs = [uuid.uuid4().hex for index in range(THREADS)]
+        barrier = threading.Barrier(THREADS)
+        references, errors = [], []
+
+        def transaction(index):
+            try:
+                with environment() as env:
+                    # the snapshots of all the transactions are taken before the creation of the child sequences
+                    env.cr.execute("SELECT 1")
+                    barrier.wait(30)
+                    for ref in (shared_refs[0], own_refs[index], shared_refs[index % 2], shared_refs[0]):
+                        references.append((ref, self._next_by_code(env, ref)))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=transaction, args=(index,)) for index in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertFalse([error for error in errors if isinstance(error, SerializationFailure)])
+        self.assertEqual(errors, [])
+        self.assertEqual(len(references), THREADS * 4)
+        self.assertEqual(len(set(references)), len(references))
+        with environment() as env:
+            self.assertEqual(sorted(self._get_children(env).mapped('generator_code')), sorted(shared_refs + own_refs))
+
+    def _set_idle(self, ref):
+        """ Set the last use of the child sequence of ref before the idle period"""
+        with environment() as env:
+            child = self._get_children(env).filtered(lambda child: child.generator_code == ref)
+            child.last_used_date = fields.Date.today() - datetime.timedelta(days=400)
+            return child.id
+
+    def _is_idle_archived(self, child_id):
+        with environment() as env:
+            return env['ir.sequence'].browse(child_id).idle_archived
+
+    def test_archive_idle_child_sequence(self):
+        """ Only the child sequences not used since the idle period are archived,their numbering continues after their
+        revival"""
+        refs = [uuid.uuid4().hex, uuid.uuid4().hex]
+        with environment() as env:
+            for ref in refs:
+                self._next_by_code(env, ref)
+        idle_child_id = self._set_idle(refs[0])
+        with environment() as env:
+            env['ir.sequence']._cron_archive_idle_child_sequences()
+        with environment() as env:
+            self.assertEqual(self._get_children(env).filtered('idle_archived').ids, [idle_child_id])
+            self.assertEqual(self._next_by_code(env, refs[0]), '00002')
+        self.assertFalse(self._is_idle_archived(idle_child_id))
+
+    def test_archive_skips_child_in_use(self):
+        """ The child sequence used by a transaction in progress is not archived until its end"""
+        ref = uuid.uuid4().hex
+        with environment() as env:
+            self._next_by_code(env, ref)
+        child_id = self._set_idle(ref)
+        with environment() as env2:
+            self.assertEqual(self._next_by_code(env2, ref), '00002')
+            with environment() as env:
+                env['ir.sequence']._cron_archive_idle_child_sequences()
+            self.assertFalse(self._is_idle_archived(child_id))
+        with environment() as env:
+            env['ir.sequence']._cron_archive_idle_child_sequences()
+        self.assertTrue(self._is_idle_archived(child_id))
+        with environment() as env:
+            self.assertEqual(self._next_by_code(env, ref), '00003')
+
+    def test_archive_committed_after_snapshot(self):
+        """ The transaction which still sees the child sequence active after its archive restores it"""
+        ref = uuid.uuid4().hex
+        with environment() as env:
+            self._next_by_code(env, ref)
+        child_id = self._set_idle(ref)
+        with environment() as env2:
+            # the snapshot of the second transaction is taken before the archive
+            env2.cr.execute("SELECT 1")
+            with environment() as env:
+                env['ir.sequence']._cron_archive_idle_child_sequences()
+            self.assertTrue(self._is_idle_archived(child_id))
+            self.assertEqual(self._next_by_code(env2, ref), '00002')
+        self.assertFalse(self._is_idle_archived(child_id))